@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Benchmarks of the path generation, the drawing and the PNG encoding.
+
+Every case runs with fixed seeds in a new process, so its peak memory isn't
+mixed up with the one of the other cases. The results can be saved as JSON
+and compared against in a later run."""
+
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import random
+import statistics
+import sys
+import time
+
+import png
+
+from core import Grid, Node, Path
+from draw import Drawer
+from generator import build_path, generate_map
+from metrics import get_peak_memory
+from pngwrite import Writer
+
+
+SIZES = [(10, 10), (30, 20), (50, 50)]
+CELL_SIZES = [50, 200]
+TOLERANCES = [0.0, 0.1, 0.3]
+
+
+def get_fixed_path(width, height, seed):
+    """Return a path that covers the whole grid, built in linear time"""
+    random.seed(seed)
+    path, _, _ = build_path(Grid(width, height), Node(0, 0), method=3)
+    return path
+
+
+def bench_method(width, height, method, tolerance, seed):
+    grid = Grid(width, height)
+    random.seed(seed)
+    start = time.perf_counter()
+    build_path(grid, Node(0, 0), method, tolerance)
+    return time.perf_counter() - start
+
+
+def bench_from_string(width, height, seed):
+    path_str = str(get_fixed_path(width, height, seed))
+    start = time.perf_counter()
+    Path.from_string(path_str)
+    return time.perf_counter() - start
+
+
+def bench_draw(width, height, cell_size, seed):
+    path = get_fixed_path(width, height, seed)
+    drawer = Drawer(path.grid, cell_size, 5, 32, False, False, False, False)
+    start = time.perf_counter()
+    drawer.init_image_array()
+    drawer.draw_path(path, 1)
+    return time.perf_counter() - start
+
+
+def bench_encode(width, height, cell_size, seed, pypng=False):
+    path = get_fixed_path(width, height, seed)
+    drawer = Drawer(path.grid, cell_size, 5, 32, False, False, False, False)
+    rows = list(drawer.iter_packed_rows(path))
+    palette = [ (0, 0, 0, 255), (255, 255, 255, 255) ]
+    if pypng:
+        w = png.Writer(drawer.img_width, drawer.img_height, palette=palette, bitdepth=1)
+    else:
+        w = Writer(drawer.img_width, drawer.img_height, palette)
+    start = time.perf_counter()
+    w.write_packed(io.BytesIO(), rows)
+    return time.perf_counter() - start
+
+
+def bench_encode_pypng(width, height, cell_size, seed):
+    # The single threaded encoder of pypng, as a reference
+    return bench_encode(width, height, cell_size, seed, pypng=True)
+
+
+def bench_preview(width, height, seed):
+    path = get_fixed_path(width, height, seed)
+    drawer = Drawer.preview(path.grid)
+    start = time.perf_counter()
+    for _ in drawer.iter_packed_rows(path):
+        pass
+    return time.perf_counter() - start
+
+
+def bench_map(width, height, cell_size, seed):
+    start = time.perf_counter()
+    generate_map(width, height, seed=seed, method=3, cell_size=cell_size,
+        color='white')
+    return time.perf_counter() - start
+
+
+def get_cases():
+    """Return the name, the function and the arguments of every case"""
+    cases = []
+    for width, height in SIZES:
+        size = f'{width}x{height}'
+        for tolerance in TOLERANCES:
+            cases.append((f'method1/{size}/tolerance={tolerance}', bench_method,
+                (width, height, 1, tolerance)))
+        cases.append((f'method2/{size}', bench_method, (width, height, 2, 0.0)))
+        cases.append((f'from_string/{size}', bench_from_string, (width, height)))
+        cases.append((f'preview/{size}', bench_preview, (width, height)))
+        for cell_size in CELL_SIZES:
+            args = (width, height, cell_size)
+            cases.append((f'draw_path/{size}/cell={cell_size}', bench_draw, args))
+            cases.append((f'encode/{size}/cell={cell_size}', bench_encode, args))
+            cases.append((f'encode_pypng/{size}/cell={cell_size}', bench_encode_pypng, args))
+            cases.append((f'map/{size}/cell={cell_size}', bench_map, args))
+    return cases
+
+
+def run_case(function, args, seeds):
+    times = [function(*args, seed) for seed in seeds]
+    return times, get_peak_memory()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile"""
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def format_memory(size):
+    if size is None:
+        return '-'
+    return f'{size / 2**20:.1f}MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of rrgen.')
+    parser.add_argument('--repeat',
+        help='The amount of times each case runs, with the seeds 0 to '
+            'REPEAT-1 (default: 5)',
+        type=int, default=5)
+    parser.add_argument('--filter',
+        help='Only run the cases whose name contains this text')
+    parser.add_argument('--save',
+        help='Save the results as JSON to this file')
+    parser.add_argument('--compare',
+        help='Compare the results with the ones saved in this file')
+    parser.add_argument('--threshold',
+        help='How much slower than the baseline the median of a case can be '
+            'before it counts as a regression (default: 0.2)',
+        type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        parser.error('--repeat must be a positive integer')
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['cases']
+
+    cases = [case for case in get_cases() if not args.filter or args.filter in case[0]]
+    seeds = list(range(args.repeat))
+
+    # A new process for each case, so the peak memory is the one of the case
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    regressions = []
+    for name, function, case_args in cases:
+        with context.Pool(1) as pool:
+            times, peak_memory = pool.apply(run_case, (function, case_args, seeds))
+
+        result = {
+            'median': statistics.median(times),
+            'p95': percentile(times, 95),
+            'peak_memory': peak_memory,
+        }
+        results[name] = result
+
+        line = f'{name:36} median {result["median"]*1000:9.2f}ms ' \
+            f'p95 {result["p95"]*1000:9.2f}ms peak {format_memory(peak_memory):>8}'
+        if name in baseline:
+            ratio = result['median'] / baseline[name]['median']
+            line += f'  {ratio:5.2f}x'
+            if ratio > 1.0 + args.threshold:
+                line += ' REGRESSION'
+                regressions.append(name)
+        print(line, flush=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version, 'repeat': args.repeat,
+                'cases': results}, f, indent=2)
+            f.write('\n')
+
+    if regressions:
+        print(f'{len(regressions)} case(s) are slower than the baseline')
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
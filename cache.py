@@ -0,0 +1,171 @@
+"""Content-addressed on-disk cache of generated paths and rendered PNGs.
+
+A path is fully determined by the options of its generation and its seed, and
+an image by its path and the render options. Entries are named after a hash
+of those, and the least recently used ones are removed when the cache grows
+over its maximum size."""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from core import Grid, Node, Path
+from pngwrite import DEFAULT_LEVEL
+
+
+# Change it whenever the same options and seed start generating other paths
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rrgen')
+DEFAULT_MAX_SIZE = 256 * 2**20
+
+
+def get_key(**fields):
+    fields['version'] = CACHE_VERSION
+    data = json.dumps(fields, sort_keys=True).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+class Cache:
+    """A cache directory of at most max_size bytes.
+
+    Paths are always stored, and PNGs only if store_png is true."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE,
+        store_png=False):
+        assert type(max_size) == int
+        assert max_size > 0
+
+        self.directory = directory
+        self.max_size = max_size
+        self.store_png = store_png
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path_key(self, width, height, start, method, tolerance, temperature,
+        backbites, mixing, seed):
+        """Return the key of a random path. start is a Node."""
+        # Ignore the options that the method doesn't use, so they don't
+        # split the same path into several entries
+        return get_key(
+            width=width,
+            height=height,
+            start=[start.x, start.y],
+            method=method,
+            tolerance=tolerance if method in [1, 4] else 0.0,
+            temperature=temperature if method == 4 else 0.0,
+            backbites=backbites if method == 3 else 0,
+            mixing=mixing if method == 2 else None,
+            seed=seed,
+        )
+
+    def get_custom_path_key(self, path):
+        """Return the key of a custom path, a core.Path or an rrp.MappedPath.
+
+        The grid and the start are part of it, since an .rrp file can put the
+        same moves in a bigger grid than their bounding box."""
+        return get_key(
+            width=path.grid.width,
+            height=path.grid.height,
+            start=[path.start.x, path.start.y],
+            path=path.get_moves(),
+        )
+
+    def get_png_key(self, path_key, color, cell_size, wall_thickness, padding,
+        hide_arrows, hide_start, hide_finish, hide_github, preview=None,
+        compression=DEFAULT_LEVEL, strategy='default'):
+        """Return the key of the image of a path. color is a Colors member."""
+        if preview is not None:
+            # Previews ignore the drawing options
+            return get_key(path=path_key, color=color.name, preview=preview,
+                compression=compression, strategy=strategy)
+        return get_key(
+            path=path_key,
+            color=color.name,
+            compression=compression,
+            strategy=strategy,
+            cell_size=cell_size,
+            wall_thickness=wall_thickness,
+            padding=padding,
+            hide_arrows=hide_arrows,
+            hide_start=hide_start,
+            hide_finish=hide_finish,
+            hide_github=hide_github,
+        )
+
+    def get_path(self, key):
+        """Return the cached path and the amount of backbites used to build
+        it, or None"""
+        data = self.read(f'{key}.path')
+        if data is None:
+            return None
+
+        entry = json.loads(data)
+        grid = Grid(entry['width'], entry['height'])
+        path = Path.from_moves(grid, Node(*entry['start']), entry['moves'])
+        return path, entry['backbites']
+
+    def put_path(self, key, path, backbites):
+        entry = {
+            'width': path.grid.width,
+            'height': path.grid.height,
+            'start': [path.start.x, path.start.y],
+            'moves': str(path),
+            'backbites': backbites,
+        }
+        self.write(f'{key}.path', json.dumps(entry).encode())
+
+    def get_png(self, key):
+        if not self.store_png:
+            return None
+        return self.read(f'{key}.png')
+
+    def put_png(self, key, data):
+        if self.store_png:
+            self.write(f'{key}.png', data)
+
+    def read(self, name):
+        filename = os.path.join(self.directory, name)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # The modification time is the last use of the entry
+            os.utime(filename)
+        except FileNotFoundError:
+            # It might have been evicted by another process in the meantime
+            return None
+        return data
+
+    def write(self, name, data):
+        # Write to a temporary file first, so other processes never read a
+        # half written entry
+        fd, temp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_filename, os.path.join(self.directory, name))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in
+        max_size"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp') or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, filename in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total -= size
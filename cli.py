@@ -1,5 +1,9 @@
 import argparse
 
+from cache import DEFAULT_CACHE_DIR
+from draw import PREVIEW_CELL_SIZE
+from pngwrite import DEFAULT_LEVEL, STRATEGIES
+
 def query_yes_no(question):
     while True:
         print(question + ' (yes/no) ', end='')
@@ -39,15 +43,49 @@ def check_tolerance(value):
         raise argparse.ArgumentTypeError(f"must be between 0.0 and 1.0: '{value}'")
     return value
 
+def check_time_budget(value):
+    try:
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: '{value}'")
+
+    if not value > 0.0:
+        raise argparse.ArgumentTypeError(f"must be a positive number: '{value}'")
+    return value
+
+def check_temperature(value):
+    try:
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: '{value}'")
+
+    if value < 0.0:
+        raise argparse.ArgumentTypeError(f"must be a non-negative number: '{value}'")
+    return value
+
+def check_geometry(value):
+    try:
+        cell_size, wall_thickness = (int(v) for v in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"must be CELL_SIZE,WALL_THICKNESS: '{value}'")
+
+    if cell_size <= 0 or wall_thickness <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive integers: '{value}'")
+    return (cell_size, wall_thickness)
+
 parser = argparse.ArgumentParser(
-    description='Generates a rope race map for the game Worms Armageddon')
+    description='Generates a rope race map for the game Worms Armageddon',
+    epilog='Run "rrgen.py serve -h" to see the options of the HTTP server')
 
 parser.add_argument('-o', '--output',
-    help='The output file (default: ./rrgen.png)',
+    help='The output file, or - to write the image to the standard output '
+        '(and the messages to the standard error) (default: ./rrgen.png)',
     default='./rrgen.png')
 parser.add_argument('-c', '--color',
     help='The color of the map. Can be any of the CSS color keywords except black. '
-        'Try --colors to see all available colors '
+        'Try --colors to see all available colors. Several colors separated '
+        'by commas render the same map in each of them '
         '(default: randomly chosen keyword color)')
 parser.add_argument('--colors',
     help='Lists all available keyword colors. '
@@ -71,6 +109,12 @@ parser.add_argument('--cell-size',
 parser.add_argument('--wall-thickness',
     help='The thickness of the wall in pixels (default: 5)',
     type=assert_is_positive, default=5)
+parser.add_argument('--geometry',
+    help='Render the map with this cell size and wall thickness in pixels, '
+        'like 100,1, instead of --cell-size and --wall-thickness. Can be given '
+        'several times to render the same map at each geometry',
+    type=check_geometry, action='append',
+    metavar='CELL_SIZE,WALL_THICKNESS')
 parser.add_argument('--width',
     help='The width of the map in number of cells/squares (default: 30)',
     type=assert_is_positive, default=30)
@@ -80,6 +124,24 @@ parser.add_argument('--height',
 parser.add_argument('--padding',
     help='The padding around the whole map in pixels (default: 32)',
     type=assert_is_non_negative, default=32)
+parser.add_argument('--preview',
+    help='Draw a small thumbnail of the map instead, with CELL_SIZE pixels per '
+        'cell, 1 pixel walls and no padding, glyphs or link. The drawing '
+        'options are ignored (default CELL_SIZE: 4)',
+    type=assert_is_positive, nargs='?', const=PREVIEW_CELL_SIZE,
+    metavar='CELL_SIZE')
+parser.add_argument('--compression',
+    help='The zlib compression level of the image, from 0 (none) to 9. Low '
+        'levels are much faster but make bigger files (default: 6)',
+    type=int, choices=range(10), default=DEFAULT_LEVEL, metavar='LEVEL')
+parser.add_argument('--strategy',
+    help='The zlib compression strategy of the image. rle is about as fast as '
+        'level 1 (default: default)',
+    choices=list(STRATEGIES), default='default')
+parser.add_argument('--encode-threads',
+    help='The amount of threads that compress the image of each map '
+        '(default: the number of CPUs, or 1 with --count)',
+    type=assert_is_positive, metavar='THREADS')
 parser.add_argument('--seed',
     help='The seed used to generate the map',
     type=int)
@@ -89,6 +151,13 @@ parser.add_argument('--show-seed',
 parser.add_argument('--show-path',
     help='Show the string version of the generated path',
     action='store_true')
+parser.add_argument('--show-backbites',
+    help='Show the amount of backbites used to generate the map',
+    action='store_true')
+parser.add_argument('--metrics',
+    help='Print the time of each phase, the peak memory and the counters of the '
+        'generation as JSON to stderr, one line per map',
+    action='store_true')
 parser.add_argument('--ignore-warning',
     help='Supresses the warning about big maps',
     action='store_true')
@@ -97,19 +166,88 @@ parser.add_argument('--method',
         ' it becomes trapped, then it performs backbite moves until it finds an'
         ' exit. Method 2 first generates a naive path, then applies 20 backbites'
         ' for each cell in the map to randomize the path. Method 2 can\' be used'
-        ' with --start-at. Both methods have similar execution times (default: 1)',
-    type=int, choices=[1, 2], default=1)
+        ' with --start-at. Both methods have similar execution times. Method 3'
+        ' doubles a random spanning tree of a grid with half the size into a'
+        ' path that fills the whole map, in linear time. Unless the map has an'
+        ' even amount of cells, method 3 must start at a corner. Method 4 works'
+        ' like method 1, but the walk prefers neighbors with less free'
+        ' neighbors (Warnsdorff\'s rule). Low temperatures need few backbites'
+        ' but give spiral-like paths, and with the default one it isn\'t'
+        ' reliably faster than method 1 on large maps (default: 1)',
+    type=int, choices=[1, 2, 3, 4], default=1)
 parser.add_argument('--tolerance',
     help='Indicates the amount of "holes" in the map in percentage. For example, '
         'a tolerance of 0.2 will accept a map with 20%% of holes instead of '
         'backbiting when it becomes trapped. The holes are not uniformly '
-        'distributed, though. This options only works with method 1 (default: 0.0)',
+        'distributed, though. This options only works with methods 1 and 4 '
+        '(default: 0.0)',
         type=check_tolerance, default=0.0)
-parser.add_argument('--path',
+parser.add_argument('--temperature',
+    help='How random the walk of method 4 is. With 0 it always follows '
+        'Warnsdorff\'s rule, and higher values get closer to the uniform walk '
+        'of method 1. This option only works with method 4 (default: 0.5)',
+    type=check_temperature, default=0.5)
+parser.add_argument('--backbites',
+    help='The amount of backbites applied at the end of method 3 for extra '
+        'variety. This option only works with method 3 (default: 0)',
+    type=assert_is_non_negative, default=0)
+parser.add_argument('--mixing',
+    help='Makes method 2 stop backbiting as soon as only this fraction of the '
+        'edges of its naive path are left, instead of always applying 20 '
+        'backbites per cell (which is still the limit). Random paths keep about '
+        'half of them, so values from 0.6 to 0.7 are a good compromise. This '
+        'option only works with method 2 (default: disabled)',
+    type=check_tolerance)
+parser.add_argument('--time-budget',
+    help='The maximum amount of seconds to spend on the path. When it runs '
+        'out, methods 1 and 4 accept the cells they covered so far, leaving '
+        'the rest as holes, and method 2 stops backbiting. What was sacrificed '
+        'is shown, and the map can\'t be generated again from its seed '
+        '(default: no limit)',
+    type=check_time_budget, metavar='SECONDS')
+parser.add_argument('--count',
+    help='The amount of maps to generate. Each map gets a seed derived from '
+        '--seed, and its index and seed are added to the output file name '
+        '(default: 1)',
+    type=assert_is_positive, default=1)
+parser.add_argument('--race',
+    help='Race this amount of walkers with seeds derived from --seed in worker '
+        'processes, and keep the map of the first one to finish. Its seed is '
+        'shown, so the map can be generated again without racing. This option '
+        'only works with methods 1 and 4 (default: 1)',
+    type=assert_is_positive, default=1, metavar='WALKERS')
+parser.add_argument('--jobs',
+    help='The amount of worker processes used to generate the maps when '
+        '--count is passed, or to race the walkers of --race (default: the '
+        'number of CPUs)',
+    type=assert_is_positive)
+parser.add_argument('--cache',
+    help='Keep the generated paths in a cache directory, so a map with the same '
+        'options and seed (but maybe another cell size or color) doesn\'t need '
+        'to be generated again (default directory: ~/.cache/rrgen)',
+    nargs='?', const=DEFAULT_CACHE_DIR, metavar='DIR')
+parser.add_argument('--cache-png',
+    help='Also keep the images in the cache. Only works with --cache',
+    action='store_true')
+parser.add_argument('--cache-size',
+    help='The maximum size of the cache in megabytes. The least recently used '
+        'entries are removed when it grows over it (default: 256)',
+    type=assert_is_positive, default=256)
+path_group = parser.add_mutually_exclusive_group()
+path_group.add_argument('--path',
     help='Use a string to generate a path instead of randomizing one. '
         'The path must be a string composed only of the letters: r, l, u, and d '
         '(meaning right, left, up, and down, respectively). '
         'If --path is passed, all options related to random generation are ignored')
+path_group.add_argument('--path-file',
+    help='Like --path, but read the path string from a file, or from the standard '
+        'input if FILE is -. Whitespace and line breaks are ignored, so long '
+        'paths can be split in lines. FILE can also be an .rrp file',
+    metavar='FILE')
+parser.add_argument('--save-rrp',
+    help='Also save the path of the map in the compact .rrp format, next to '
+        'the image and with the same name',
+    action='store_true')
 
 start_group = parser.add_mutually_exclusive_group()
 start_group.add_argument('--start',
@@ -42,6 +42,15 @@ class Node:
         return neighbors
 
 
+# The letter of each move, by its (dx, dy)
+_LETTERS = {
+    (1, 0)  : 'r',
+    (0, 1)  : 'u',
+    (-1, 0) : 'l',
+    (0, -1) : 'd',
+}
+
+
 class Edge:
     """Represents an edge in a 2-D grid graph."""
 
@@ -63,14 +72,8 @@ class Edge:
         return hash((self.src, self.dst))
 
     def get_letter_repr(self):
-        direction = self.dst - self.src
-        translation = {
-            Node(1, 0)  : 'r',
-            Node(0, 1)  : 'u',
-            Node(-1, 0) : 'l',
-            Node(0, -1) : 'd',
-        }
-        return translation.get(direction, '?')
+        direction = (self.dst.x - self.src.x, self.dst.y - self.src.y)
+        return _LETTERS.get(direction, '?')
 
     def reverse(self):
         self.src, self.dst = self.dst, self.src
@@ -120,6 +123,10 @@ class Path:
         edges = ''.join([ e.get_letter_repr() for e in self.edges ])
         return f'{edges}'
 
+    def get_moves(self):
+        """Return the moves of the path, as in the custom path strings"""
+        return str(self)
+
     def add_edge(self, edge):
         assert type(edge) == Edge
         assert not edge.src.is_out_of_bounds(self.grid)
@@ -133,6 +140,15 @@ class Path:
         self.visited.append(edge.dst)
         self.edges.append(edge)
 
+    def get_occupancy(self):
+        """Return a bytearray with 1 for each visited cell of the grid, at the
+        index y * width + x"""
+        occupancy = bytearray(self.grid.get_size())
+        for node in self.visited:
+            if not node.is_out_of_bounds(self.grid):
+                occupancy[node.y * self.grid.width + node.x] = 1
+        return occupancy
+
     def get_last_node(self):
         if len(self.edges) == 0:
             return self.start
@@ -244,69 +260,91 @@ class Path:
         for i in range(20 * self.grid.get_size()):
             self.backbite()
 
+    @staticmethod
+    def from_moves(grid, start, moves):
+        """Return the path in grid that starts at start and follows the moves
+        string, raising ValueError if it leaves the grid or overlaps itself"""
+        assert type(grid) == Grid
+        assert type(start) == Node
+
+        steps = {'r': (1, 0), 'u': (0, 1), 'l': (-1, 0), 'd': (0, -1)}
+        x, y = start.x, start.y
+        nodes = [start]
+        seen = {(x, y)}
+        for move in moves:
+            if move not in steps:
+                raise ValueError(f'Invalid move: {move!r}')
+            dx, dy = steps[move]
+            x, y = x + dx, y + dy
+            if not 0 <= x < grid.width or not 0 <= y < grid.height:
+                raise ValueError('The path leaves the grid')
+            if (x, y) in seen:
+                raise ValueError('The path overlaps itself')
+            seen.add((x, y))
+            nodes.append(Node(x, y))
+
+        path = Path(grid, start=start)
+        path.edges = [Edge(src, dst) for src, dst in zip(nodes, nodes[1:])]
+        path.visited = nodes
+        return path
+
     @staticmethod
     def from_string(s):
-        """Return a path from a given custom string"""
-
-        # Check the string
-        for char in s:
-            if char not in "rlud":
-                exit("Error: The path string can only contain the characters: "
-                    "'r', 'l' , 'u', and 'd'")
-
-        # Initialize the path
-        visited = [Node(0, 0)]
-        edges = []
-
-        moves = {
-            'r': Node(1, 0),
-            'u': Node(0, 1),
-            'l': Node(-1, 0),
-            'd': Node(0, -1),
-        }
-
-        edges.append(Edge(Node(0, 0), Node(0, 0) + moves[s[0]]))
-        visited.append(Node(0, 0) + moves[s[0]])
-
-        # Build the path
-        for move in s[1:]:
-            src = edges[-1].dst
-            dst = src + moves[move]
-
-            # Check if path overlaps
-            if dst in visited:
-                exit("Error: The string provided creates a path that overlaps")
-
-            edges.append(Edge(src, dst))
-            visited.append(dst)
-
-        # Find the bounding grid
-        lowest, leftmost = 0, 0
-        for node in visited:
-            if node.x < leftmost:
-                leftmost = node.x
-            if node.y < lowest:
-                lowest = node.y
-
-        # Shift every coordinate
-        for edge in edges:
-            edge.src = Node(edge.src.x - leftmost, edge.src.y - lowest)
-            edge.dst = Node(edge.dst.x - leftmost, edge.dst.y - lowest)
-
-        for node in visited:
-            node = Node(node.x - leftmost, node.y - lowest)
-
-        highest, rightmost = 0, 0
-        for node in visited:
-            if node.x > rightmost:
-                rightmost = node.x
-            if node.y > highest:
-                highest = node.y
+        """Return a path from a given custom string
+
+        Raises ValueError if the string has other characters than r, l, u
+        and d (whitespace is ignored), or if the path overlaps itself"""
+        return Path.from_chunks([s])
+
+    @staticmethod
+    def from_file(f, chunk_size=65536):
+        """Return a path from the custom string in the text file f, which is
+        read in chunks so the string is never held whole in memory"""
+        return Path.from_chunks(iter(lambda: f.read(chunk_size), ''))
+
+    @staticmethod
+    def from_chunks(chunks):
+        """Return a path from the custom string split in chunks, in O(n)
+
+        Each position (x, y) is packed in a single int, x + y * STRIDE, so the
+        overlap check is a set lookup. x and y start at STRIDE // 2 so they
+        never go negative, and the grid is the bounding box of the path."""
+        stride = 2**32
+        origin = stride // 2 * (stride + 1)
+        steps = {'r': 1, 'l': -1, 'u': stride, 'd': -stride}
+
+        position = origin
+        positions = [origin]
+        seen = {origin}
+        for chunk in chunks:
+            chunk = ''.join(chunk.split())
+            if chunk.strip('rlud'):
+                raise ValueError('The path string can only contain the '
+                    'characters: \'r\', \'l\' , \'u\', and \'d\'')
+
+            for move in chunk:
+                position += steps[move]
+                if position in seen:
+                    raise ValueError('The string provided creates a path that '
+                        'overlaps')
+                seen.add(position)
+                positions.append(position)
+
+        if len(positions) == 1:
+            raise ValueError('The path string is empty')
+
+        # Shift every coordinate so the lowest and leftmost ones are 0
+        coordinates = [divmod(p, stride) for p in positions]
+        lowest = min(y for y, x in coordinates)
+        leftmost = min(x for y, x in coordinates)
+        visited = [Node(x - leftmost, y - lowest) for y, x in coordinates]
 
         # The bounding grid
+        highest = max(node.y for node in visited)
+        rightmost = max(node.x for node in visited)
         grid = Grid(rightmost+1, highest+1)
 
-        path = Path(grid, start=edges[0].src)
-        path.edges = edges
+        path = Path(grid, start=visited[0])
+        path.edges = [Edge(src, dst) for src, dst in zip(visited, visited[1:])]
         path.visited = visited
         return path
@@ -1,9 +1,93 @@
-from core import Grid, Node, Path
+import functools
+import re
+
+from core import Grid, Node
+
+
+class Glyph:
+    """A bitmap pattern compiled into runs of set pixels.
+
+    pattern is a list of strings of '0' and '1', from the top row to the
+    bottom one. runs has, for each row from the bottom, the (start, length)
+    of each horizontal run of 1s, so drawing it takes one slice per run."""
+
+    def __init__(self, pattern):
+        assert type(pattern) == list
+
+        self.width = max(len(row) for row in pattern)
+        self.height = len(pattern)
+        self.runs = []
+        for row in reversed(pattern):
+            runs = []
+            for match in re.finditer('1+', row):
+                runs.append((match.start(), match.end() - match.start()))
+            self.runs.append(tuple(runs))
+
+
+RD_ARROW = Glyph([
+    '11111100',
+    '00000100',
+    '00000100',
+    '00000100',
+    '00011111',
+    '00001110',
+    '00000100',
+])
+
+
+UL_ARROW = Glyph([
+    '0010000',
+    '0110000',
+    '1111111',
+    '0110001',
+    '0010001',
+    '0000001',
+    '0000001',
+    '0000001',
+])
+
+
+LD_ARROW = Glyph([
+    '00111111',
+    '00100000',
+    '00100000',
+    '00100000',
+    '11111000',
+    '01110000',
+    '00100000',
+])
+
+
+UR_ARROW = Glyph([
+    '0000100',
+    '0000110',
+    '1111111',
+    '1000110',
+    '1000100',
+    '1000000',
+    '1000000',
+    '1000000',
+])
+
+
+# Font: Berkelium 1541
+LINK = Glyph([
+    '00001010010000000100000000000000000000000000010010001000000000000000000000000000000000000',
+    '01100011011001010110000010010011010000010011011011000001100110010000010010010011001001100',
+    '10101010010101010101000100101010101000100110010010101010101010101000100100100101010101010',
+    '10101010010101010101000100101010101001000011010010101010101010101001000100100101011001010',
+    '01101001010100110110010010010010101010000110001010101001100110010010000100100011001101010',
+    '01000000000000000000000000000000000000000000000000000000000100000000000000000010000000000',
+])
+
+
+# The default cell size of previews, in pixels
+PREVIEW_CELL_SIZE = 4
 
 
 class Drawer:
     def __init__(self, grid, cell_size, wall_thickness, padding,
-        hide_arrows, hide_start, hide_finish, hide_github):
+        hide_arrows, hide_start, hide_finish, hide_github, minimum_size=True):
 
         assert type(grid) == Grid
         assert type(cell_size) == int
@@ -28,13 +112,69 @@ class Drawer:
         self.img_width, self.img_height = self.get_image_dimensions()
 
         # Force minimum dimensions
-        if self.img_width < 640:
+        if minimum_size and self.img_width < 640:
             self.img_width = 640
-        if self.img_height < 32:
+        if minimum_size and self.img_height < 32:
             self.img_height = 32
 
+    @classmethod
+    def preview(cls, grid, cell_size=PREVIEW_CELL_SIZE):
+        """Return a drawer of thumbnails, with cell_size pixels per cell, 1px
+        walls and no padding, glyphs or minimum dimensions
+
+        Its cells always fit in tiles, so iter_rows puts the image together
+        from them without ever allocating the whole image."""
+        assert type(cell_size) == int
+        assert cell_size >= 2
+        return cls(grid, cell_size, 1, 0, True, True, True, True,
+            minimum_size=False)
+
     def init_image_array(self):
-        self.img = [[0] * self.img_width for _ in range(self.img_height)]
+        self.init_band(0, self.img_height)
+
+    def init_band(self, y, rows):
+        """Allocate the rows y up to y+rows of the image. Anything drawn outside
+        of them is clipped
+
+        The rows are kept one after the other in a bytearray, with img_width
+        bytes per row, starting at the bottom."""
+        self.img_y = y
+        self.img_rows = rows
+        self.img = bytearray(rows * self.img_width)
+
+    def clip_rows(self, y, length):
+        """Return the range of band rows for image rows y up to y+length"""
+        start = max(y - self.img_y, 0)
+        stop = min(y + length - self.img_y, self.img_rows)
+        return range(start, stop)
+
+    def get_rows(self):
+        """Return the rows of the band from the top, as memoryviews"""
+        stride = self.img_width
+        view = memoryview(self.img)
+        return [view[j*stride:(j+1)*stride] for j in reversed(range(self.img_rows))]
+
+    def fill_rect(self, x, y, width, height, color):
+        """Set every pixel of a rectangle, clipped to the band"""
+        start = max(x, 0)
+        stop = min(x + width, self.img_width)
+        rows = self.clip_rows(y, height)
+        if start >= stop or len(rows) == 0:
+            return
+
+        stride = self.img_width
+        img = self.img
+        # Use whichever takes less slice assignments: one per row, or one
+        # strided slice per column
+        if stop - start >= len(rows):
+            run = bytes([color]) * (stop - start)
+            for j in rows:
+                img[j*stride + start:j*stride + stop] = run
+        else:
+            column = bytes([color]) * len(rows)
+            first, last = rows.start * stride, rows.stop * stride
+            for i in range(start, stop):
+                img[first + i:last + i:stride] = column
 
     def get_image_dimensions(self):
         # Find the minimum required width and height
@@ -56,26 +196,19 @@ class Drawer:
 
         x, y = start
         if direction == 'horizontal':
-            for i in range(x, x + length):
-                for j in range(y, y + self.wall_thickness):
-                    self.img[j][i] = color
+            self.fill_rect(x, y, length, self.wall_thickness, color)
         elif direction == 'vertical':
-            for i in range(x, x + self.wall_thickness):
-                for j in range(y, y + length):
-                    self.img[j][i] = color
+            self.fill_rect(x, y, self.wall_thickness, length, color)
 
     def draw_pattern(self, start, pattern, color):
         assert type(start) == tuple
-        assert type(pattern) == list
+        assert type(pattern) == Glyph
         assert type(color) == int
 
         x, y = start
-        pattern.reverse()
-        for j in range(len(pattern)):
-            for i in range(len(pattern[j])):
-                if int(pattern[j][i]) != 0 \
-                    and 0 <= x < self.img_width and 0 <= y < self.img_height:
-                    self.img[y + j][x + i] = color
+        for j in self.clip_rows(y, pattern.height):
+            for i, length in pattern.runs[j + self.img_y - y]:
+                self.fill_rect(x + i, j + self.img_y, length, 1, color)
 
     def fill(self, node, color):
         assert type(node) == Node
@@ -85,19 +218,40 @@ class Drawer:
         x = self.padding + node.x * self.cell_size
         y = self.padding + node.y * self.cell_size
 
-        for i in range(x, x + self.cell_size):
-            for j in range(y, y + self.cell_size):
-                self.img[j][i] = color
-
-    def fill_holes(self, visited, color):
+        self.fill_rect(x, y, self.cell_size, self.cell_size, color)
+
+    def get_hole_runs(self, occupancy):
+        """Return, for each grid row, the (x, length) of each run of holes
+
+        occupancy is the bitmap of Path.get_occupancy."""
+        width = self.grid.width
+        runs = []
+        for j in range(self.grid.height):
+            row = occupancy[j*width:(j+1)*width]
+            row_runs = []
+            start = row.find(0)
+            while start != -1:
+                stop = row.find(1, start)
+                if stop == -1:
+                    stop = width
+                row_runs.append((start, stop - start))
+                start = row.find(0, stop)
+            runs.append(row_runs)
+        return runs
+
+    def fill_hole_run(self, x, y, length, color):
+        """Fill length holes of grid row y, starting at x, as one rectangle"""
+        self.fill_rect(self.padding + x * self.cell_size,
+            self.padding + y * self.cell_size,
+            length * self.cell_size, self.cell_size, color)
+
+    def fill_holes(self, occupancy, color):
         assert type(color) == int
         assert 0 <= color < 64
 
-        for i in range(self.grid.width):
-            for j in range(self.grid.height):
-                node = Node(i, j)
-                if node not in visited:
-                    self.fill(node, color)
+        for j, row_runs in enumerate(self.get_hole_runs(occupancy)):
+            for x, length in row_runs:
+                self.fill_hole_run(x, j, length, color)
 
     def draw_outer_walls(self, color):
         assert type(color) == int
@@ -210,19 +364,9 @@ class Drawer:
         if self.hide_arrows:
             return
 
-        arrow = [
-            '11111100',
-            '00000100',
-            '00000100',
-            '00000100',
-            '00011111',
-            '00001110',
-            '00000100',
-        ]
-
-        x = self.padding + (node.x + 1) * self.cell_size - len(arrow[0]) - 1
-        y = self.padding + (node.y + 1) * self.cell_size - len(arrow) - 2
-        self.draw_pattern((x, y), arrow, color)
+        x = self.padding + (node.x + 1) * self.cell_size - RD_ARROW.width - 1
+        y = self.padding + (node.y + 1) * self.cell_size - RD_ARROW.height - 2
+        self.draw_pattern((x, y), RD_ARROW, color)
 
     def draw_ul_arrow(self, node, color):
         assert type(node) == Node
@@ -230,20 +374,9 @@ class Drawer:
         if self.hide_arrows:
             return
 
-        arrow = [
-            '0010000',
-            '0110000',
-            '1111111',
-            '0110001',
-            '0010001',
-            '0000001',
-            '0000001',
-            '0000001',
-        ]
-
-        x = self.padding + (node.x + 1) * self.cell_size - len(arrow[0]) - 2
-        y = self.padding + (node.y + 1) * self.cell_size - len(arrow) - 1
-        self.draw_pattern((x, y), arrow, color)
+        x = self.padding + (node.x + 1) * self.cell_size - UL_ARROW.width - 2
+        y = self.padding + (node.y + 1) * self.cell_size - UL_ARROW.height - 1
+        self.draw_pattern((x, y), UL_ARROW, color)
 
     def draw_ld_arrow(self, node, color):
         assert type(node) == Node
@@ -251,19 +384,9 @@ class Drawer:
         if self.hide_arrows:
             return
 
-        arrow = [
-            '00111111',
-            '00100000',
-            '00100000',
-            '00100000',
-            '11111000',
-            '01110000',
-            '00100000',
-        ]
-
         x = self.padding + node.x * self.cell_size + self.wall_thickness + 1
-        y = self.padding + (node.y + 1) * self.cell_size - len(arrow) - 2
-        self.draw_pattern((x, y), arrow, color)
+        y = self.padding + (node.y + 1) * self.cell_size - LD_ARROW.height - 2
+        self.draw_pattern((x, y), LD_ARROW, color)
 
     def draw_ur_arrow(self, node, color):
         assert type(node) == Node
@@ -271,20 +394,9 @@ class Drawer:
         if self.hide_arrows:
             return
 
-        arrow = [
-            '0000100',
-            '0000110',
-            '1111111',
-            '1000110',
-            '1000100',
-            '1000000',
-            '1000000',
-            '1000000',
-        ]
-
         x = self.padding + node.x * self.cell_size + self.wall_thickness + 2
-        y = self.padding + (node.y + 1) * self.cell_size - len(arrow) - 1
-        self.draw_pattern((x, y), arrow, color)
+        y = self.padding + (node.y + 1) * self.cell_size - UR_ARROW.height - 1
+        self.draw_pattern((x, y), UR_ARROW, color)
 
     def draw_s(self, node, color):
         assert type(node) == Node
@@ -370,21 +482,174 @@ class Drawer:
             self.draw_right_wall(node, color)
             self.draw_ul_arrow(node, color)
 
+    def get_layout(self, path):
+        """Return the cells of path and the holes, grouped by grid row
+
+        Each cell is a tuple (node, kind, move), where kind is 'start', 'end' or
+        'cell' and move is the letter (or two letters, for 'cell') of the moves
+        that leave and enter it. The holes are runs (x, length) of cells.
+
+        Only the start, the moves and the occupancy of path are used, so it can
+        be a core.Path or anything with the same start, get_moves() and
+        get_occupancy(), like rrp.MappedPath."""
+        steps = {'r': (1, 0), 'u': (0, 1), 'l': (-1, 0), 'd': (0, -1)}
+        cells = [[] for _ in range(self.grid.height)]
+
+        moves = path.get_moves()
+        node = path.start
+        cells[node.y].append((node, 'start', moves[0]))
+        x, y = node.x, node.y
+        for i in range(len(moves) - 1):
+            dx, dy = steps[moves[i]]
+            x, y = x + dx, y + dy
+            cells[y].append((Node(x, y), 'cell', moves[i:i+2]))
+        dx, dy = steps[moves[-1]]
+        node = Node(x + dx, y + dy)
+        cells[node.y].append((node, 'end', moves[-1]))
+
+        holes = self.get_hole_runs(path.get_occupancy())
+        return cells, holes
+
+    def draw_layout_rows(self, layout, rows, color):
+        """Draw the cells and holes of layout in the given grid rows"""
+        cells, holes = layout
+        for j in rows:
+            for node, kind, move in cells[j]:
+                if kind == 'start':
+                    self.draw_start_cell(node, move, color)
+                elif kind == 'end':
+                    self.draw_end_cell(node, move, color)
+                else:
+                    self.draw_cell(node, move, color)
+            for x, length in holes[j]:
+                self.fill_hole_run(x, j, length, color)
+
     def draw_path(self, path, color):
-        assert type(path) == Path
-
-        path_str = str(path)
-        start_node = path.edges[0].src
-        self.draw_start_cell(start_node, path_str[0], color)
-        for i in range(len(path_str)-1):
-            node = path.edges[i].dst
-            self.draw_cell(node, path_str[i:i+2], color)
-        node = path.edges[i+1].dst
-        self.draw_end_cell(node, path_str[-1], color)
+        layout = self.get_layout(path)
+        self.draw_layout_rows(layout, range(self.grid.height), color)
         self.draw_link(color)
         self.draw_outer_walls(color)
-        self.fill_holes(path.visited, color)
 
+    def iter_rows(self, path, color, layout=None):
+        """Draw path and yield the rows of the image from the top to the bottom
+
+        When the cell geometry allows it, the rows of the grid are put together
+        from pre-rendered tiles (see iter_tile_rows). Otherwise the image is
+        drawn in bands of cell_size rows, so only one band is kept in memory at
+        a time. Each band redraws the cells of the grid rows that can reach it,
+        and everything is clipped to the band.
+
+        layout is the one of get_layout, which only depends on the path, so it
+        can be shared by drawers of several geometries."""
+        if layout is None:
+            layout = self.get_layout(path)
+        if self.tiles_fit():
+            yield from self.iter_tile_rows(layout, color)
+            return
+
+        # Walls and glyphs can reach a bit beyond the rows of their cell
+        margin = 3 * self.wall_thickness + 16
+        band_size = self.cell_size
+        for y in reversed(range(0, self.img_height, band_size)):
+            rows = min(band_size, self.img_height - y)
+            self.init_band(y, rows)
+
+            lowest = max((y - self.padding - margin) // self.cell_size - 1, 0)
+            highest = min((y + rows - self.padding + margin) // self.cell_size + 1,
+                self.grid.height - 1)
+            self.draw_layout_rows(layout, range(lowest, highest + 1), color)
+            self.draw_link(color)
+            self.draw_outer_walls(color)
+
+            yield from self.get_rows()
+
+    def iter_packed_rows(self, path, layout=None):
+        """Like iter_rows, but with 8 pixels per byte for a 1-bit PNG"""
+        last_row, packed = None, None
+        for row in self.iter_rows(path, 1, layout):
+            # Most rows of a cell are the same as the one below, so only pack
+            # rows that changed
+            if row != last_row:
+                last_row, packed = bytes(row), pack_row(row)
+            yield packed
+
+    def tiles_fit(self):
+        return tiles_fit(self.cell_size, self.wall_thickness,
+            self.hide_arrows, self.hide_start, self.hide_finish)
+
+    def get_tiles(self, layout, color):
+        """Return, for each grid row, the tiles of its cells from left to right
+
+        A tile covers the cell_size x cell_size pixels from the bottom left
+        corner of its cell. Only the left and bottom walls of a cell fall in
+        it, since its right and top walls are the left and bottom walls of its
+        neighbors. The bottom left corner is also set when the cell to the left
+        has a bottom wall, which reaches into it."""
+        cells, holes = layout
+        width, height = self.grid.width, self.grid.height
+
+        kinds = [[('hole', '')] * width for _ in range(height)]
+        for row in cells:
+            for node, kind, move in row:
+                kinds[node.y][node.x] = (kind, move)
+
+        # Most cells share a few tiles, so look them up here before going
+        # through the cache of render_tile
+        known_tiles = {}
+        tiles = []
+        for j in range(height):
+            row_tiles = []
+            has_bottom_wall = False
+            for i in range(width):
+                kind, move = kinds[j][i]
+                key = (kind, move, has_bottom_wall)
+                tile = known_tiles.get(key)
+                if tile is None:
+                    tile = known_tiles[key] = render_tile(self.cell_size,
+                        self.wall_thickness, self.hide_arrows, self.hide_start,
+                        self.hide_finish, kind, move, has_bottom_wall, color)
+                row_tiles.append(tile)
+
+                if kind == 'start':
+                    has_bottom_wall = move != 'd'
+                elif kind == 'end':
+                    has_bottom_wall = move != 'u'
+                elif kind == 'cell':
+                    has_bottom_wall = move[0] != 'u' and move[1] != 'd'
+                else:
+                    has_bottom_wall = False
+            tiles.append(row_tiles)
+        return tiles
+
+    def iter_tile_rows(self, layout, color):
+        """Yield the rows of the image from the top, copying the rows of the
+        tiles of each cell side by side"""
+        width, height = self.grid.width, self.grid.height
+        cell_size, wall_thickness = self.cell_size, self.wall_thickness
+        grid_top = self.padding + height * cell_size
+        right_padding = self.img_width - self.padding - width * cell_size - wall_thickness
+
+        left = bytes(self.padding)
+        right = bytes([color]) * wall_thickness + bytes(right_padding)
+        top_wall = left + bytes([color]) * (width * cell_size + wall_thickness) \
+            + bytes(right_padding)
+        empty = bytes(self.img_width)
+
+        for y in range(self.img_height - 1, grid_top + wall_thickness - 1, -1):
+            yield empty
+        for y in range(wall_thickness):
+            yield top_wall
+
+        tiles = self.get_tiles(layout, color)
+        for j in reversed(range(height)):
+            tile_rows = list(zip(*tiles[j]))
+            for r in reversed(range(cell_size)):
+                yield left + b''.join(tile_rows[r]) + right
+
+        # The padding below the grid only has the link
+        self.init_band(0, self.padding)
+        self.draw_link(color)
+        yield from self.get_rows()
 
     def draw_all_walls(self, node, color):
         self.draw_left_wall(node, color)
@@ -398,16 +663,79 @@ class Drawer:
         if self.hide_github:
             return
 
-        # Font: Berkelium 1541
-        link = [
-            '00001010010000000100000000000000000000000000010010001000000000000000000000000000000000000',
-            '01100011011001010110000010010011010000010011011011000001100110010000010010010011001001100',
-            '10101010010101010101000100101010101000100110010010101010101010101000100100100101010101010',
-            '10101010010101010101000100101010101001000011010010101010101010101001000100100101011001010',
-            '01101001010100110110010010010010101010000110001010101001100110010010000100100011001101010',
-            '01000000000000000000000000000000000000000000000000000000000100000000000000000010000000000',
-        ]
-
+        # Only draw the link when it fits in the padding
         x = self.padding
-        y = self.padding - len(link) - 1
-        self.draw_pattern((x, y), link, color)
+        y = self.padding - LINK.height - 1
+        if y < 0:
+            return
+        self.draw_pattern((x, y), LINK, color)
+
+
+# Maps the pixels 0 and 1 to the digits of a binary number
+_BINARY_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def pack_row(row):
+    """Pack a row of 0 and 1 pixels into bytes with 8 pixels each, the first
+    pixel in the most significant bit. The length of row must be a multiple
+    of 8, which Drawer.get_image_dimensions already ensures"""
+    digits = bytes(row).translate(_BINARY_DIGITS)
+    return int(digits, 2).to_bytes(len(row) // 8, 'big')
+
+
+@functools.lru_cache(maxsize=512)
+def render_tile(cell_size, wall_thickness, hide_arrows, hide_start, hide_finish,
+    kind, move, corner, color):
+    """Render the tile of a cell, as a tuple with its rows from the bottom
+
+    kind and move are the ones of Drawer.get_layout, or 'hole' for holes. The
+    tiles are cached, so batches with the same geometry reuse them."""
+    drawer = Drawer(Grid(1, 1), cell_size, wall_thickness, 0,
+        hide_arrows, hide_start, hide_finish, True)
+    drawer.init_band(0, cell_size)
+
+    node = Node(0, 0)
+    if kind == 'start':
+        drawer.draw_start_cell(node, move, color)
+    elif kind == 'end':
+        drawer.draw_end_cell(node, move, color)
+    elif kind == 'cell':
+        drawer.draw_cell(node, move, color)
+    else:
+        drawer.fill(node, color)
+    if corner:
+        drawer.fill_rect(0, 0, wall_thickness, wall_thickness, color)
+
+    stride = drawer.img_width
+    img = drawer.img
+    return tuple(bytes(img[j*stride:j*stride + cell_size]) for j in range(cell_size))
+
+
+@functools.lru_cache(maxsize=64)
+def tiles_fit(cell_size, wall_thickness, hide_arrows, hide_start, hide_finish):
+    """Tell whether the walls and glyphs of a cell stay inside its tile
+
+    Otherwise, tiles would cut parts of them and the image must be drawn."""
+    if wall_thickness >= cell_size:
+        return False
+
+    # Draw every glyph in the middle of a large image and look for pixels
+    # outside of the cell
+    padding = 2 * cell_size + wall_thickness + 16
+    drawer = Drawer(Grid(1, 1), cell_size, wall_thickness, padding,
+        hide_arrows, hide_start, hide_finish, True)
+    drawer.init_image_array()
+
+    node = Node(0, 0)
+    drawer.draw_s(node, 1)
+    drawer.draw_f(node, 1)
+    drawer.draw_rd_arrow(node, 1)
+    drawer.draw_ul_arrow(node, 1)
+    drawer.draw_ld_arrow(node, 1)
+    drawer.draw_ur_arrow(node, 1)
+
+    stride = drawer.img_width
+    inside = 0
+    for j in range(padding, padding + cell_size):
+        inside += drawer.img.count(1, j*stride + padding, j*stride + padding + cell_size)
+    return inside == drawer.img.count(1)
@@ -0,0 +1,532 @@
+import math
+import random
+import time
+
+from core import Edge, Grid, Node, Path
+
+
+def supports_method3_start(width, height, x, y):
+    """Tell whether method 3 can build a path on a width x height grid that
+    starts at (x, y)
+
+    Grids with an even number of cells get a Hamiltonian cycle, so any cell
+    works. Otherwise, and on grids one cell wide, it must be a corner."""
+    if width == 1 or height == 1 or (width * height) % 2 == 1:
+        return x in (0, width - 1) and y in (0, height - 1)
+    return True
+
+
+def supports_full_path_start(width, height, x, y):
+    """Tell whether a path that starts at (x, y) can visit every cell of a
+    width x height grid
+
+    Coloring the cells like a chessboard, a path alternates colors, so on
+    grids with an odd number of cells it must start on the color of the
+    corners, which has one more cell. On grids one cell wide, it must start at
+    one of the ends."""
+    if width == 1 or height == 1:
+        return x in (0, width - 1) and y in (0, height - 1)
+    if (width * height) % 2 == 1:
+        return (x + y) % 2 == 0
+    return True
+
+
+class FlatGrid:
+    """A 2-D grid where each cell is the integer y * width + x.
+
+    The neighbors of every cell are computed once and kept in the same order
+    used by Node.get_neighbors (right, up, left, down), so that random choices
+    made over them match the ones made by core.Path."""
+
+    def __init__(self, width, height):
+        assert type(width) == int
+        assert type(height) == int
+
+        self.width = width
+        self.height = height
+        self.neighbors = [self.compute_neighbors(cell) for cell in range(self.get_size())]
+
+    def __str__(self):
+        return f'FlatGrid[{self.width}x{self.height}]'
+
+    def get_size(self):
+        return self.height * self.width
+
+    def compute_neighbors(self, cell):
+        y, x = divmod(cell, self.width)
+        neighbors = []
+        if x + 1 < self.width:
+            neighbors.append(cell + 1)
+        if y + 1 < self.height:
+            neighbors.append(cell + self.width)
+        if x - 1 >= 0:
+            neighbors.append(cell - 1)
+        if y - 1 >= 0:
+            neighbors.append(cell - self.width)
+        return tuple(neighbors)
+
+    def index(self, node):
+        assert type(node) == Node
+        assert not node.is_out_of_bounds(Grid(self.width, self.height))
+        return node.y * self.width + node.x
+
+    def node(self, cell):
+        y, x = divmod(cell, self.width)
+        return Node(x, y)
+
+    def is_corner(self, cell):
+        y, x = divmod(cell, self.width)
+        return x in (0, self.width - 1) and y in (0, self.height - 1)
+
+    def supports_method3_start(self, cell):
+        """Tell whether method 3 can build a path that starts at cell (see
+        supports_method3_start)"""
+        y, x = divmod(cell, self.width)
+        return supports_method3_start(self.width, self.height, x, y)
+
+
+# Maps a reversal flag to its opposite
+_TOGGLE = bytes.maketrans(b'\x00\x01', b'\x01\x00')
+
+
+class BlockSequence:
+    """A sequence of distinct cells that can find the position of a cell and
+    reverse a suffix in O(sqrt(n)).
+
+    The cells are split into blocks of about sqrt(n) cells, each one with a
+    flag that tells whether the block must be read backwards. Reversing a
+    suffix splits at most one block, then reverses the order of the blocks
+    after it and toggles their flags, without touching the cells at all."""
+
+    def __init__(self, size):
+        assert type(size) == int
+
+        self.block_size = max(8, math.isqrt(size))
+        self.block_of = [None] * size
+        self.blocks = []
+        self.flags = bytearray()
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for block, flag in zip(self.blocks, self.flags):
+            if flag:
+                yield from reversed(block)
+            else:
+                yield from block
+
+    def append(self, cell):
+        blocks = self.blocks
+        if len(blocks) == 0 or self.flags[-1] or len(blocks[-1]) >= self.block_size:
+            blocks.append([])
+            self.flags.append(0)
+
+        block = blocks[-1]
+        block.append(cell)
+        self.block_of[cell] = block
+        self.length += 1
+
+    def from_end(self, k):
+        """Return the k-th cell counting from the end (0 is the last one)"""
+        for block, flag in zip(reversed(self.blocks), reversed(self.flags)):
+            if k < len(block):
+                return block[k] if flag else block[-1 - k]
+            k -= len(block)
+        raise IndexError('sequence index out of range')
+
+    def locate(self, cell):
+        """Return the index of the block of cell and its offset in the block"""
+        block = self.block_of[cell]
+        # Blocks are never empty and never share cells, so no two of them
+        # compare equal and index() finds this exact block
+        i = self.blocks.index(block)
+        k = block.index(cell)
+        if self.flags[i]:
+            k = len(block) - 1 - k
+        return i, k
+
+    def split(self, i, k):
+        """Split block i so that its first k cells form a block of their own"""
+        block = self.blocks[i]
+        flag = self.flags[i]
+        if flag:
+            k = len(block) - k
+
+        # Move the smaller half to a new list so less cells are relocated
+        if k <= len(block) - k:
+            new_block = block[:k]
+            del block[:k]
+            position = i + 1 if flag else i
+        else:
+            new_block = block[k:]
+            del block[k:]
+            position = i if flag else i + 1
+
+        self.blocks.insert(position, new_block)
+        self.flags.insert(position, flag)
+
+        block_of = self.block_of
+        for cell in new_block:
+            block_of[cell] = new_block
+
+    def reverse_after(self, cell):
+        """Reverse the part of the sequence that comes after cell"""
+        i, k = self.locate(cell)
+        if k + 1 < len(self.blocks[i]):
+            self.split(i, k + 1)
+
+        self.blocks[i+1:] = self.blocks[:i:-1]
+        self.flags[i+1:] = self.flags[:i:-1].translate(_TOGGLE)
+
+        # Splits leave small blocks behind, so rebuild once there are too many
+        if len(self.blocks) > 4 * (self.length // self.block_size + 1):
+            self.rebuild()
+
+    def rebuild(self):
+        cells = []
+        for block, flag in zip(self.blocks, self.flags):
+            cells.extend(reversed(block) if flag else block)
+
+        size = self.block_size
+        self.blocks = [cells[i:i+size] for i in range(0, len(cells), size)]
+        self.flags = bytearray(len(self.blocks))
+
+        block_of = self.block_of
+        for block in self.blocks:
+            for cell in block:
+                block_of[cell] = block
+
+
+def _link_doubled_tree(successor, width, x0, y0, w, h):
+    """Link the cells of a w x h region into a Hamiltonian cycle
+
+    The region starts at (x0, y0) and w and h must be even. Each 2x2 block of
+    the region is a cell of a half-size grid. A random spanning tree of that
+    grid is built with Kruskal's algorithm, and the cycle is the walk around
+    the tree. successor[cell] is set to the next cell of the cycle."""
+    assert w % 2 == 0 and h % 2 == 0
+
+    half_width, half_height = w // 2, h // 2
+
+    # Each block starts as a small counterclockwise cycle
+    corners = []
+    for by in range(half_height):
+        for bx in range(half_width):
+            c = (y0 + 2 * by) * width + x0 + 2 * bx
+            successor[c] = c + 1
+            successor[c + 1] = c + 1 + width
+            successor[c + 1 + width] = c + width
+            successor[c + width] = c
+            corners.append(c)
+
+    edges = []
+    for b in range(half_width * half_height):
+        if b % half_width + 1 < half_width:
+            edges.append((b, b + 1, True))
+        if b + half_width < half_width * half_height:
+            edges.append((b, b + half_width, False))
+    random.shuffle(edges)
+
+    parent = list(range(half_width * half_height))
+
+    def find(b):
+        while parent[b] != b:
+            parent[b] = parent[parent[b]]
+            b = parent[b]
+        return b
+
+    # Every edge of the tree merges the cycles of its two blocks into one
+    for a, b, horizontal in edges:
+        root_a, root_b = find(a), find(b)
+        if root_a == root_b:
+            continue
+        parent[root_a] = root_b
+
+        c = corners[a]
+        if horizontal:
+            successor[c + 1] = c + 2
+            successor[c + 2 + width] = c + 1 + width
+        else:
+            successor[c + 1 + width] = c + 1 + 2 * width
+            successor[c + 2 * width] = c + width
+
+
+def _add_detour(successor, a, b, offset):
+    """Replace the cycle edge between a and b by a detour through a+offset and
+    b+offset"""
+    if successor[a] != b:
+        a, b = b, a
+    assert successor[a] == b
+
+    successor[a] = a + offset
+    successor[a + offset] = b + offset
+    successor[b + offset] = b
+
+
+class FlatPath:
+    """A path in a FlatGrid.
+
+    The cells of the path are kept in order in a BlockSequence, so backbites
+    cost O(sqrt(n)) instead of O(n), and the visited cells in a bytearray.
+    Given the same seed, the build methods produce exactly the same path as
+    the ones in core.Path."""
+
+    def __init__(self, grid, start=0):
+        assert type(grid) == FlatGrid
+        assert type(start) == int
+        assert 0 <= start < grid.get_size()
+
+        self.grid = grid
+        self.start = start
+        self.cells = BlockSequence(grid.get_size())
+        self.cells.append(start)
+        self.visited = bytearray(grid.get_size())
+        self.visited[start] = 1
+        self.visited_count = 1
+        self.backbites = 0
+        self.deadline_reached = False
+
+    def __str__(self):
+        width = self.grid.width
+        # Vertical moves come last so they win when the grid is 1 cell wide
+        translation = {1: 'r', -1: 'l', width: 'u', -width: 'd'}
+        order = list(self.cells)
+        return ''.join([translation[b - a] for a, b in zip(order, order[1:])])
+
+    def add_cell(self, cell):
+        assert not self.visited[cell]
+
+        self.cells.append(cell)
+        self.visited[cell] = 1
+        self.visited_count += 1
+
+    def get_occupancy(self):
+        """Return the bytearray of visited cells, as core.Path.get_occupancy"""
+        return self.visited
+
+    def get_last_cell(self):
+        return self.cells.from_end(0)
+
+    def pick_next_cell(self):
+        visited = self.visited
+        candidates = [c for c in self.grid.neighbors[self.get_last_cell()] if not visited[c]]
+        if len(candidates) == 0:
+            return None
+        return random.choice(candidates)
+
+    def backbite(self):
+        # Pick a neighbor that is not the previous cell of the path as pivot
+        neighbors = list(self.grid.neighbors[self.get_last_cell()])
+        neighbors.remove(self.cells.from_end(1))
+
+        assert len(neighbors) > 0
+        pivot = random.choice(neighbors)
+
+        # Link the pivot to the last cell and reverse everything after it
+        self.cells.reverse_after(pivot)
+        self.backbites += 1
+        return pivot
+
+    def pick_next_cell_warnsdorff(self, temperature):
+        """Pick a non-visited neighbor favoring the ones with less non-visited
+        neighbors of their own (Warnsdorff's rule)
+
+        Each candidate is weighted by exp(-free / temperature). A temperature
+        of 0 always picks one of the candidates with the least free neighbors."""
+        visited = self.visited
+        neighbors = self.grid.neighbors
+        candidates = [c for c in neighbors[self.get_last_cell()] if not visited[c]]
+        if len(candidates) == 0:
+            return None
+
+        free = [sum(1 for n in neighbors[c] if not visited[n]) for c in candidates]
+        least = min(free)
+        if temperature == 0.0:
+            return random.choice([c for c, f in zip(candidates, free) if f == least])
+
+        # Relative to the best candidate, whose weight is 1, so low
+        # temperatures can't underflow every weight to 0
+        weights = [math.exp(-(f - least) / temperature) for f in free]
+        return random.choices(candidates, weights)[0]
+
+    def past_deadline(self, deadline):
+        if deadline is not None and time.perf_counter() > deadline:
+            self.deadline_reached = True
+        return self.deadline_reached
+
+    def build_path_method1(self, tolerance=0.0, deadline=None):
+        """Build path randomly with backbiting
+
+        tolerance = max. percentage of holes accepted
+        deadline = time.perf_counter() value after which the path is accepted
+        as it is the next time the walk gets trapped"""
+        assert type(tolerance) == float
+        assert 0.0 <= tolerance <= 1.0
+
+        while self.visited_count < (1.0-tolerance) * self.grid.get_size():
+            candidate = self.pick_next_cell()
+            if candidate is not None:
+                self.add_cell(candidate)
+            elif self.past_deadline(deadline):
+                break
+            else:
+                self.backbite()
+
+    def build_path_method4(self, tolerance=0.0, temperature=0.5, deadline=None):
+        """Build path like method 1, but guide the random walk with
+        Warnsdorff's rule so it gets trapped less often
+
+        tolerance = max. percentage of holes accepted
+        temperature = how random the walk is (0 = pure Warnsdorff's rule)
+        deadline = as in build_path_method1"""
+        assert type(tolerance) == float
+        assert 0.0 <= tolerance <= 1.0
+        assert type(temperature) == float
+        assert temperature >= 0.0
+
+        while self.visited_count < (1.0-tolerance) * self.grid.get_size():
+            candidate = self.pick_next_cell_warnsdorff(temperature)
+            if candidate is not None:
+                self.add_cell(candidate)
+            elif self.past_deadline(deadline):
+                break
+            else:
+                self.backbite()
+
+    def is_along_border(self, cell):
+        width, height = self.grid.width, self.grid.height
+        visited = self.visited
+        y, x = divmod(cell, width)
+
+        # Horizontal neighbor: check the upper and lower cells
+        if y == self.get_last_cell() // width:
+            return y + 1 >= height or visited[cell + width] \
+                or y - 1 < 0 or visited[cell - width]
+
+        # Vertical neighbor: check the right and left cells
+        return x - 1 < 0 or visited[cell - 1] \
+            or x + 1 >= width or visited[cell + 1]
+
+    def get_edge_id(self, a, b):
+        """Return a number that identifies the edge between the neighbors a
+        and b, whatever its direction"""
+        return 2 * min(a, b) + (abs(a - b) == self.grid.width)
+
+    def build_path_method2(self, mixing=None, deadline=None):
+        """Build a naive path along the borders, then randomize it with 20
+        backbites per cell
+
+        mixing = if given, stop backbiting as soon as the fraction of the edges
+        of the naive path that are still in the path drops to it
+        deadline = time.perf_counter() value after which backbiting stops"""
+        assert mixing is None or type(mixing) == float
+        visited = self.visited
+
+        while True:
+            # If there are no non-visited neighbors, the path is done
+            neighbors = self.grid.neighbors[self.get_last_cell()]
+            non_visited_neighbors = [n for n in neighbors if not visited[n]]
+            if len(non_visited_neighbors) == 0:
+                break
+
+            # Only consider neighbors that are along an edge
+            candidates = [n for n in non_visited_neighbors if self.is_along_border(n)]
+            self.add_cell(random.choice(candidates))
+
+        # Apply backbite 20 times per cell in the grid to randomize the path
+        moves = 20 * self.grid.get_size()
+        if mixing is None and deadline is None:
+            for i in range(moves):
+                self.backbite()
+        else:
+            self.mix(moves, mixing, deadline)
+
+    def mix(self, moves, mixing=None, deadline=None):
+        """Apply up to moves backbites, stopping once at most the mixing
+        fraction of the current edges are left or the deadline passes"""
+        cells = list(self.cells)
+        original = bytearray(2 * self.grid.get_size())
+        for a, b in zip(cells, cells[1:]):
+            original[self.get_edge_id(a, b)] = 1
+
+        # A backbite adds the edge from the pivot to the last cell, and removes
+        # the one from the pivot to the cell after it, which becomes the last
+        remaining = len(cells) - 1
+        target = -1 if mixing is None else mixing * remaining
+        for i in range(moves):
+            if remaining <= target or self.past_deadline(deadline):
+                break
+            last = self.get_last_cell()
+            pivot = self.backbite()
+            remaining += original[self.get_edge_id(pivot, last)]
+            remaining -= original[self.get_edge_id(pivot, self.get_last_cell())]
+
+    def build_path_method3(self, backbites=0):
+        """Build path from a random spanning tree of the half-size grid
+
+        The walk around the doubled tree is a Hamiltonian cycle, which is cut
+        at the start. An odd column or row is absorbed by detours from the
+        cycle, and when both dimensions are odd the start row is walked first.
+
+        backbites = amount of backbites applied at the end for variety"""
+        assert type(backbites) == int
+        assert backbites >= 0
+        assert len(self.cells) == 1
+        assert self.grid.supports_method3_start(self.start)
+
+        width, height = self.grid.width, self.grid.height
+        size = self.grid.get_size()
+        start_y, start_x = divmod(self.start, width)
+
+        # Grids one cell wide only have the straight path, and their cells are
+        # numbered along it
+        if width == 1 or height == 1:
+            step = 1 if self.start == 0 else -1
+            for i in range(1, size):
+                self.add_cell(self.start + i * step)
+            return
+
+        successor = [-1] * size
+        cell = self.start
+        if size % 2 == 1:
+            # Walk the start row, then step into the cycle of the other rows
+            step = 1 if start_x == 0 else -1
+            for i in range(width - 1):
+                cell += step
+                self.add_cell(cell)
+            y0 = 1 if start_y == 0 else 0
+            cell += width if start_y == 0 else -width
+            self.add_cell(cell)
+            height -= 1
+        else:
+            y0 = 0
+
+        even_width, even_height = width - width % 2, height - height % 2
+        _link_doubled_tree(successor, self.grid.width, 0, y0, even_width, even_height)
+        if even_width < width:
+            for y in range(y0, y0 + even_height, 2):
+                a = y * width + even_width - 1
+                _add_detour(successor, a, a + width, 1)
+        if even_height < height:
+            for x in range(0, even_width, 2):
+                a = (y0 + even_height - 1) * width + x
+                _add_detour(successor, a, a + 1, width)
+
+        for i in range(size - self.visited_count):
+            cell = successor[cell]
+            self.add_cell(cell)
+
+        for i in range(backbites):
+            self.backbite()
+
+    def to_path(self):
+        """Return the equivalent core.Path"""
+        grid = Grid(self.grid.width, self.grid.height)
+        nodes = [self.grid.node(cell) for cell in self.cells]
+
+        path = Path(grid, start=nodes[0])
+        path.edges = [Edge(src, dst) for src, dst in zip(nodes, nodes[1:])]
+        path.visited = nodes
+        return path
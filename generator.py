@@ -0,0 +1,550 @@
+"""Library API to generate rope race maps without going through the CLI.
+
+Importing this module has no side effects, so a long running process can
+import it once and call generate_map for every map it needs."""
+
+import io
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+
+from colors import Colors
+from core import Grid, Node, Path
+from draw import Drawer
+from engine import (FlatGrid, FlatPath, supports_full_path_start,
+    supports_method3_start)
+from metrics import CountingWriter, Metrics
+from pngwrite import DEFAULT_LEVEL, STRATEGIES, Writer
+
+
+START_CORNERS = ['bottom_left', 'top_left', 'top_right', 'bottom_right']
+
+MAX_IMAGE_WIDTH = 32512
+MAX_IMAGE_HEIGHT = 32600
+
+
+class GeneratedMap:
+    """The result of generate_map.
+
+    png holds the encoded image, unless it was written to an output file.
+    metrics holds the timing and counters of the run, as Metrics.to_dict.
+    sacrificed is None, unless the time budget ran out (see build_path).
+    variants is only set by generate_variants."""
+
+    def __init__(self, path, seed, color, backbites, png=None, metrics=None,
+        sacrificed=None, variants=None):
+        self.path = path
+        self.seed = seed
+        self.color = color
+        self.backbites = backbites
+        self.png = png
+        self.metrics = metrics
+        self.sacrificed = sacrificed
+        self.variants = variants
+
+
+def get_start_node(width, height, start):
+    """Return the start node from a corner name or a pair of coordinates"""
+    if start in START_CORNERS:
+        start_options = {
+            'bottom_left' : Node(0, 0),
+            'bottom_right' : Node(width-1, 0),
+            'top_left' : Node(0, height-1),
+            'top_right' : Node(width-1, height-1),
+        }
+        return start_options[start]
+
+    x, y = start
+    if not 0 <= x < width or not 0 <= y < height:
+        raise ValueError('Start position values for X and Y must be within '
+            'boundaries: 0 <= X < WIDTH and 0 <= Y < HEIGHT')
+    return Node(x, y)
+
+
+def get_color(color):
+    """Return a Colors member from a member, a name or None (random)"""
+    if color is None:
+        return random.choice(list(Colors))
+    if isinstance(color, Colors):
+        return color
+    try:
+        return Colors[color]
+    except KeyError:
+        raise ValueError(f'Color \'{color}\' doesn\'t exist. '
+            'Try --colors to see all the available colors.')
+
+
+def check_options(width=30, height=20, method=1, tolerance=0.0,
+    start='bottom_left', path=None, cell_size=200, wall_thickness=5, padding=32,
+    race=1, preview=None):
+    """Validate the options of a map, raising ValueError if they are invalid
+
+    path is a custom path string, a core.Path or an rrp.MappedPath. Returns
+    the grid and the start node of the map"""
+    if path is not None:
+        if isinstance(path, str):
+            path = Path.from_string(path)
+        grid = path.grid
+        start_node = None
+    else:
+        if method not in [1, 2, 3, 4]:
+            raise ValueError(f'Invalid method: {method}')
+
+        # A path needs at least one move
+        if width * height < 2:
+            raise ValueError('The map must have at least 2 cells')
+
+        # The naive path of method 2 goes around the borders
+        if method == 2 and (width == 1 or height == 1):
+            raise ValueError('Method 2 can\'t be used on maps one cell wide')
+
+        # Prevent method 2 with start_at
+        if method == 2 and start not in START_CORNERS:
+            raise ValueError('Method 2 can\'t be used with --start-at')
+
+        # The other methods take about the same time with any seed
+        if race > 1 and method not in [1, 4]:
+            raise ValueError('Only methods 1 and 4 can race walkers')
+
+        # Prevents too high of a tolerance (that would result in an empty map)
+        if method in [1, 4] and (1.0-tolerance) * width * height < 1:
+            raise ValueError('Tolerance is too high. An empty map would be generated.')
+
+        grid = Grid(width, height)
+        start_node = get_start_node(width, height, start)
+
+    # Check the dimensions first, before anything takes memory for each cell
+    if preview is not None:
+        if preview < 2:
+            raise ValueError('The cell size of a preview must be at least 2')
+        drawer = Drawer.preview(grid, preview)
+    else:
+        drawer = Drawer(grid, cell_size, wall_thickness, padding,
+            False, False, False, False)
+    if drawer.img_width > MAX_IMAGE_WIDTH or drawer.img_height > MAX_IMAGE_HEIGHT:
+        raise ValueError('The generated map would exceed the maximum dimensions: '
+            f'{MAX_IMAGE_WIDTH}x{MAX_IMAGE_HEIGHT}')
+
+    # Method 3 needs a corner to start unless the map has an even amount of cells
+    if path is None and method == 3 and not supports_method3_start(width, height,
+        start_node.x, start_node.y):
+        raise ValueError('Method 3 must start at a corner when the map is '
+            'one cell wide or has an odd amount of cells')
+
+    # On maps one cell wide, a walk that isn't done when it reaches an end
+    # has nothing to backbite
+    if path is None and method in [1, 4] and (width == 1 or height == 1) \
+        and not supports_full_path_start(width, height, start_node.x, start_node.y):
+        raise ValueError('Methods 1 and 4 must start at an end of the map when '
+            'it is one cell wide')
+
+    # Methods 1 and 4 would backbite forever looking for a coverage that no
+    # path from the start can reach
+    if path is None and method in [1, 4] and not supports_full_path_start(width,
+        height, start_node.x, start_node.y) \
+        and width * height - 1 < (1.0-tolerance) * width * height:
+        raise ValueError('No path from this start can cover the whole map. On '
+            'maps with an odd amount of cells, X + Y must be even (or the '
+            'tolerance must allow a hole)')
+
+    return grid, start_node
+
+
+def build_path(grid, start_node, method=1, tolerance=0.0, temperature=0.5,
+    backbites=0, mixing=None, deadline=None, metrics=None):
+    """Build a random path with the given method
+
+    mixing is the adaptive stop of method 2 (see FlatPath.build_path_method2).
+    After the time.perf_counter() value deadline, methods 1 and 4 accept the
+    coverage they reached and method 2 stops backbiting.
+
+    Returns the path, the amount of backbites used to build it and what was
+    sacrificed to meet the deadline: None, {'coverage': fraction of the cells
+    in the path} or {'skipped_backbites': amount}. If metrics is given, the
+    random walk steps and the backbites are counted in it."""
+    flat_grid = FlatGrid(grid.width, grid.height)
+    flat_path = FlatPath(flat_grid, start=flat_grid.index(start_node))
+    if method == 1:
+        flat_path.build_path_method1(tolerance, deadline)
+    elif method == 2:
+        flat_path.build_path_method2(mixing, deadline)
+    elif method == 3:
+        flat_path.build_path_method3(backbites)
+    elif method == 4:
+        flat_path.build_path_method4(tolerance, temperature, deadline)
+
+    sacrificed = None
+    if flat_path.deadline_reached:
+        size = flat_grid.get_size()
+        if method == 2:
+            sacrificed = {'skipped_backbites': 20 * size - flat_path.backbites}
+        else:
+            sacrificed = {'coverage': flat_path.visited_count / size}
+
+    if metrics is not None:
+        # Cells are never removed from the path, so every step added one
+        metrics.count('steps', flat_path.visited_count - 1)
+        metrics.count('backbites', flat_path.backbites)
+    return flat_path.to_path(), flat_path.backbites, sacrificed
+
+
+def check_encoding(compression, strategy):
+    """Raise ValueError if the options of the PNG compression are invalid"""
+    if compression not in range(10):
+        raise ValueError('The compression level must be between 0 and 9')
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Invalid compression strategy: {strategy}')
+
+
+def get_palette(color):
+    return [ (0, 0, 0, 255), color.value ]
+
+
+def write_png(path, output, color, cell_size=200, wall_thickness=5, padding=32,
+    hide_arrows=False, hide_start=False, hide_finish=False, hide_github=False,
+    metrics=None, preview=None, layout=None, compression=DEFAULT_LEVEL,
+    strategy='default', encode_threads=None):
+    """Draw path and write it as a PNG to the file-like object output
+
+    If preview is a cell size, a thumbnail is drawn instead (see
+    Drawer.preview) and the other drawing options are ignored. layout is the
+    one of Drawer.get_layout, if it's already known. compression and strategy
+    are the zlib level and the name of a strategy of pngwrite.STRATEGIES, and
+    encode_threads the amount of threads that compress the image (see
+    pngwrite.Writer). The rows are drawn while the PNG is encoded, so if
+    metrics is given the time spent drawing goes to the render phase and the
+    rest to encode."""
+    if preview is not None:
+        drawer = Drawer.preview(path.grid, preview)
+    else:
+        drawer = Drawer(path.grid, cell_size, wall_thickness, padding,
+            hide_arrows, hide_start, hide_finish, hide_github)
+
+    w = Writer(drawer.img_width, drawer.img_height, get_palette(color),
+        level=compression, strategy=STRATEGIES[strategy], threads=encode_threads)
+    if metrics is None:
+        w.write_packed(output, drawer.iter_packed_rows(path, layout))
+        return
+
+    rows = metrics.time_rows(drawer.iter_packed_rows(path, layout), 'render')
+    output = CountingWriter(output)
+    render_time = metrics.phases.get('render', 0.0)
+    with metrics.phase('encode'):
+        w.write_packed(output, rows)
+    # The rows were drawn from inside write_packed
+    metrics.phases['encode'] -= metrics.phases['render'] - render_time
+    metrics.count('pixels_written', drawer.img_width * drawer.img_height)
+    metrics.count('bytes_encoded', output.written)
+
+
+def set_png_color(png_data, color):
+    """Return png_data, an image written by write_png, in another color
+
+    The pixels are indices into the palette, so only the palette chunks (PLTE
+    and tRNS) and their CRCs change."""
+    palette = get_palette(color)
+    new_chunks = {
+        b'PLTE': b''.join(bytes(entry[:3]) for entry in palette),
+        b'tRNS': bytes(entry[3] for entry in palette),
+    }
+
+    parts = [png_data[:8]]
+    offset = 8
+    while offset < len(png_data):
+        length, chunk_type = struct.unpack_from('>I4s', png_data, offset)
+        end = offset + 12 + length
+        if chunk_type in new_chunks:
+            data = new_chunks[chunk_type]
+            crc = zlib.crc32(chunk_type + data)
+            parts.append(struct.pack('>I4s', len(data), chunk_type) + data
+                + struct.pack('>I', crc))
+        else:
+            parts.append(png_data[offset:end])
+        offset = end
+    return b''.join(parts)
+
+
+def render_variants(path, geometries, colors, padding=32, hide_arrows=False,
+    hide_start=False, hide_finish=False, hide_github=False, metrics=None,
+    compression=DEFAULT_LEVEL, strategy='default', encode_threads=None):
+    """Render path at each (cell_size, wall_thickness) of geometries, in each
+    of colors (Colors members)
+
+    Returns a list of (cell_size, wall_thickness, color, png), in the order of
+    geometries and then colors. The cells of the path are classified once for
+    every geometry, and each geometry is drawn and encoded once: the other
+    colors only get another palette (see set_png_color)."""
+    cell_size, wall_thickness = geometries[0]
+    layout = Drawer(path.grid, cell_size, wall_thickness, padding, hide_arrows,
+        hide_start, hide_finish, hide_github).get_layout(path)
+
+    variants = []
+    for cell_size, wall_thickness in geometries:
+        buffer = io.BytesIO()
+        write_png(path, buffer, colors[0], cell_size, wall_thickness, padding,
+            hide_arrows, hide_start, hide_finish, hide_github, metrics,
+            layout=layout, compression=compression, strategy=strategy,
+            encode_threads=encode_threads)
+        png_data = buffer.getvalue()
+        variants.append((cell_size, wall_thickness, colors[0], png_data))
+        for color in colors[1:]:
+            variants.append((cell_size, wall_thickness, color,
+                set_png_color(png_data, color)))
+    return variants
+
+
+def get_deadline(time_budget):
+    if time_budget is None:
+        return None
+    return time.perf_counter() + time_budget
+
+
+def _race_walker(job):
+    grid, start_node, method, tolerance, temperature, time_budget, seed = job
+    # The same steps as generate_map, so the seed alone reproduces the path
+    random.seed(seed)
+    metrics = Metrics()
+    path, used_backbites, sacrificed = build_path(grid, start_node, method,
+        tolerance, temperature, deadline=get_deadline(time_budget),
+        metrics=metrics)
+    return seed, str(path), used_backbites, sacrificed, metrics.counters
+
+
+def race_path(grid, start_node, method, tolerance, temperature, seed, walkers,
+    jobs=None, deadline=None, metrics=None):
+    """Build a path with each of walkers seeds derived from seed in up to jobs
+    processes, and keep the first one that finishes
+
+    The other walkers are stopped. Returns the path, its backbites, what was
+    sacrificed to meet the deadline (as in build_path) and the seed that
+    generates it alone."""
+    # Processes don't necessarily share a clock, so they get the time left
+    time_budget = None if deadline is None else deadline - time.perf_counter()
+    tasks = [(grid, start_node, method, tolerance, temperature, time_budget,
+        walker_seed) for walker_seed in get_batch_seeds(seed, walkers)]
+
+    with multiprocessing.Pool(min(walkers, jobs or os.cpu_count())) as pool:
+        results = pool.imap_unordered(_race_walker, tasks)
+        seed, moves, used_backbites, sacrificed, counters = next(results)
+        # Leaving the block terminates the walkers that are still running
+
+    if metrics is not None:
+        metrics.count('walkers', walkers)
+        for name, amount in counters.items():
+            metrics.count(name, amount)
+    path = Path.from_moves(grid, start_node, moves)
+    return path, used_backbites, sacrificed, seed
+
+
+def get_path(width, height, seed, method, tolerance, temperature, backbites,
+    mixing, race, jobs, deadline, path, grid, start_node, cache, metrics):
+    """Return the path of a map, its backbites, what was sacrificed to meet the
+    deadline, its cache key (or None) and its seed, which is the one of the
+    winning walker if they raced
+
+    The path is taken from the cache when it's there, and stored otherwise.
+    Paths cut short by the deadline aren't stored, since their seed doesn't
+    reproduce them."""
+    if path is not None:
+        key = None if cache is None else cache.get_custom_path_key(path)
+        return path, 0, None, key, seed
+
+    if race > 1:
+        path, used_backbites, sacrificed, seed = race_path(grid, start_node,
+            method, tolerance, temperature, seed, race, jobs, deadline, metrics)
+    else:
+        if cache is not None:
+            key = cache.get_path_key(width, height, start_node, method,
+                tolerance, temperature, backbites, mixing, seed)
+            cached = cache.get_path(key)
+            if cached is not None:
+                metrics.count('path_cache_hits')
+                return cached[0], cached[1], None, key, seed
+
+        path, used_backbites, sacrificed = build_path(grid, start_node, method,
+            tolerance, temperature, backbites, mixing, deadline, metrics)
+
+    if cache is None or sacrificed is not None:
+        return path, used_backbites, sacrificed, None, seed
+
+    # The seed that wins a race is only known now
+    key = cache.get_path_key(width, height, start_node, method, tolerance,
+        temperature, backbites, mixing, seed)
+    cache.put_path(key, path, used_backbites)
+    return path, used_backbites, sacrificed, key, seed
+
+
+def generate_map(width=30, height=20, seed=None, method=1, tolerance=0.0,
+    temperature=0.5, backbites=0, mixing=None, start='bottom_left', path=None,
+    cell_size=200, wall_thickness=5, padding=32, hide_arrows=False,
+    hide_start=False, hide_finish=False, hide_github=False, color=None,
+    output=None, cache=None, race=1, jobs=None, time_budget=None, preview=None,
+    compression=DEFAULT_LEVEL, strategy='default', encode_threads=None):
+    """Generate a map and encode it as a PNG
+
+    start is one of START_CORNERS or a pair of coordinates (X, Y). path is a
+    custom path string, a core.Path (see Path.from_file) or an rrp.MappedPath,
+    in which case the options related to random generation are ignored. color
+    is a Colors member, a color name or None for a random color. If output is
+    a writable file-like object the PNG is written to it, otherwise it is
+    returned in the png attribute of the result. cache is an optional
+    cache.Cache to take the path and the image from. With race > 1, that many
+    walkers race in up to jobs processes (see race_path), and the seed of the
+    result is the one of the winner. If time_budget seconds pass before the
+    path is done, it's finished early (see build_path). If preview is a cell
+    size, a small thumbnail is drawn instead of the map (see Drawer.preview).
+    compression, strategy and encode_threads tune the compression of the PNG
+    (see write_png).
+
+    Raises ValueError if the options are invalid."""
+    deadline = get_deadline(time_budget)
+    check_encoding(compression, strategy)
+    color = get_color(color)
+    if isinstance(path, str):
+        path = Path.from_string(path)
+    grid, start_node = check_options(width, height, method, tolerance, start,
+        path, cell_size, wall_thickness, padding, race, preview)
+
+    if seed is None:
+        seed = random.randrange(sys.maxsize)
+    random.seed(seed)
+
+    metrics = Metrics()
+    with metrics.phase('total'):
+        with metrics.phase('path'):
+            path, used_backbites, sacrificed, path_key, seed = get_path(width,
+                height, seed, method, tolerance, temperature, backbites, mixing,
+                race, jobs, deadline, path, grid, start_node, cache, metrics)
+
+        png_data = None
+        if path_key is not None:
+            png_key = cache.get_png_key(path_key, color, cell_size,
+                wall_thickness, padding, hide_arrows, hide_start, hide_finish,
+                hide_github, preview, compression, strategy)
+            png_data = cache.get_png(png_key)
+
+        if png_data is not None:
+            metrics.count('png_cache_hits')
+        else:
+            # Keep the encoded image in memory only when it's needed
+            keep_png = output is None or (path_key is not None and cache.store_png)
+            buffer = io.BytesIO() if keep_png else output
+            write_png(path, buffer, color, cell_size, wall_thickness, padding,
+                hide_arrows, hide_start, hide_finish, hide_github, metrics,
+                preview, compression=compression, strategy=strategy,
+                encode_threads=encode_threads)
+            if keep_png:
+                png_data = buffer.getvalue()
+                if path_key is not None:
+                    cache.put_png(png_key, png_data)
+
+        if output is not None and png_data is not None:
+            output.write(png_data)
+
+    metrics = metrics.to_dict()
+    if sacrificed is not None:
+        metrics['sacrificed'] = sacrificed
+    result = GeneratedMap(path, seed, color, used_backbites, metrics=metrics,
+        sacrificed=sacrificed)
+    if output is None:
+        result.png = png_data
+    return result
+
+
+def generate_variants(geometries, colors=None, width=30, height=20, seed=None,
+    method=1, tolerance=0.0, temperature=0.5, backbites=0, mixing=None,
+    start='bottom_left', path=None, padding=32, hide_arrows=False,
+    hide_start=False, hide_finish=False, hide_github=False, cache=None, race=1,
+    jobs=None, time_budget=None, compression=DEFAULT_LEVEL, strategy='default',
+    encode_threads=None):
+    """Generate one map and render it at each (cell_size, wall_thickness) of
+    geometries, in each of colors
+
+    colors is a list of colors like the one of generate_map, and defaults to
+    one random color. The other options are the ones of generate_map, and
+    only the path is cached. The images are in the variants attribute of the
+    result (see render_variants), and its color is the first one.
+
+    Raises ValueError if the options are invalid."""
+    if not geometries:
+        raise ValueError('At least one geometry is needed')
+    deadline = get_deadline(time_budget)
+    check_encoding(compression, strategy)
+    colors = [get_color(color) for color in colors or [None]]
+    if isinstance(path, str):
+        path = Path.from_string(path)
+    for cell_size, wall_thickness in geometries:
+        grid, start_node = check_options(width, height, method, tolerance,
+            start, path, cell_size, wall_thickness, padding, race)
+
+    if seed is None:
+        seed = random.randrange(sys.maxsize)
+    random.seed(seed)
+
+    metrics = Metrics()
+    with metrics.phase('total'):
+        with metrics.phase('path'):
+            path, used_backbites, sacrificed, _, seed = get_path(width, height,
+                seed, method, tolerance, temperature, backbites, mixing, race,
+                jobs, deadline, path, grid, start_node, cache, metrics)
+        variants = render_variants(path, geometries, colors, padding,
+            hide_arrows, hide_start, hide_finish, hide_github, metrics,
+            compression, strategy, encode_threads)
+
+    metrics = metrics.to_dict()
+    if sacrificed is not None:
+        metrics['sacrificed'] = sacrificed
+    return GeneratedMap(path, seed, colors[0], used_backbites, metrics=metrics,
+        sacrificed=sacrificed, variants=variants)
+
+
+def get_batch_seeds(master_seed, count):
+    """Derive the seed of each map of a batch from the master seed"""
+    rng = random.Random(master_seed)
+    return [rng.randrange(sys.maxsize) for _ in range(count)]
+
+
+def get_batch_filename(filename, index, seed):
+    if os.path.isdir(filename):
+        return os.path.join(filename, f'rrgen-{index}-{seed}.png')
+    if filename.endswith('.png'):
+        filename = filename[:-len('.png')]
+    return f'{filename}-{index}-{seed}.png'
+
+
+def _generate_batch_map(job):
+    filename, options = job
+    with open(filename, 'wb') as f:
+        result = generate_map(output=f, **options)
+    return filename, result
+
+
+def generate_batch(count, filename, seed=None, jobs=None, **options):
+    """Generate count maps in parallel worker processes
+
+    The seed of each map is derived from seed, and the maps are written to
+    files named after filename with their index and seed. The other options
+    are the ones of generate_map. Yields the file name and the result of each
+    map, in order."""
+    if seed is None:
+        seed = random.randrange(sys.maxsize)
+
+    # Worker processes can't start processes of their own
+    if options.get('race', 1) > 1:
+        raise ValueError('Walkers can\'t race in a batch')
+    # The maps are already compressed in parallel
+    if options.get('encode_threads') is None:
+        options['encode_threads'] = 1
+
+    color = options.pop('color', None)
+    batch = []
+    for i, map_seed in enumerate(get_batch_seeds(seed, count)):
+        map_options = dict(options, seed=map_seed, color=get_color(color))
+        batch.append((get_batch_filename(filename, i, map_seed), map_options))
+
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap(_generate_batch_map, batch)
@@ -0,0 +1,80 @@
+"""Per-phase timing and counters of a map generation."""
+
+import contextlib
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+class Metrics:
+    """Collects the wall time of each phase and the counters of a run.
+
+    Phases can be entered several times, and their times add up."""
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def time_rows(self, rows, phase):
+        """Wrap an iterator of rows, adding the time spent producing them
+        to phase"""
+        rows = iter(rows)
+        while True:
+            with self.phase(phase):
+                row = next(rows, None)
+            if row is None:
+                return
+            yield row
+
+    def to_dict(self):
+        data = {
+            'phases': {name: round(t, 6) for name, t in self.phases.items()},
+            'counters': dict(self.counters),
+            'peak_memory': get_peak_memory(),
+        }
+
+        path_time = self.phases.get('path', 0.0)
+        if 'backbites' in self.counters and path_time > 0:
+            data['backbites_per_second'] = round(self.counters['backbites'] / path_time, 1)
+        return data
+
+
+class CountingWriter:
+    """A file-like wrapper that counts the bytes written to it"""
+
+    def __init__(self, output):
+        self.output = output
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.output.write(data)
+
+
+def get_peak_memory():
+    """Return the peak resident memory of the process in bytes, or None if it
+    can't be known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
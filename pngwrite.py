@@ -0,0 +1,187 @@
+"""PNG writer for the indexed images of rrgen, with parallel compression.
+
+The image data of a PNG is a single zlib stream, split in IDAT chunks. Like
+pigz, the rows are gathered in chunks that are compressed independently in a
+thread pool (zlib releases the GIL while it compresses). Each chunk is a raw
+deflate stream primed with the last 32KB of the previous chunk and ended with
+a sync flush, so the chunks put together in order are one valid deflate
+stream. Their adler32 checksums are combined into the one of the whole
+stream. Every row uses filter type 0 (none), which is the best one for the
+long runs of the same color of a map."""
+
+import collections
+import concurrent.futures
+import os
+import struct
+import zlib
+
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The amount of filtered row bytes compressed by each task
+CHUNK_SIZE = 256 * 1024
+
+# The history that deflate can refer to
+WINDOW_SIZE = 32 * 1024
+
+DEFAULT_LEVEL = 6
+
+STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+
+_ADLER_BASE = 65521
+
+
+def adler32_combine(adler1, adler2, length2):
+    """Return the adler32 of two pieces of data put together, given the
+    adler32 of each and the length of the second one (as zlib's
+    adler32_combine)"""
+    rem = length2 % _ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = rem * sum1 % _ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xffff) + _ADLER_BASE - 1) % _ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + _ADLER_BASE - rem) % _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def get_zlib_header(level, strategy):
+    """Return the 2 bytes that start a zlib stream with a 32KB window"""
+    if level == zlib.Z_DEFAULT_COMPRESSION:
+        level = DEFAULT_LEVEL
+    # The compression level flag, as zlib sets it
+    if strategy >= zlib.Z_HUFFMAN_ONLY or level < 2:
+        flevel = 0
+    elif level < 6:
+        flevel = 1
+    elif level == 6:
+        flevel = 2
+    else:
+        flevel = 3
+    header = (0x78 << 8) | (flevel << 6)
+    header += 31 - header % 31
+    return struct.pack('>H', header)
+
+
+def deflate_chunk(data, dictionary, last, level, strategy):
+    """Compress data as a piece of a raw deflate stream
+
+    dictionary is the data that comes right before it in the stream. Returns
+    the compressed data, the adler32 of data and its length."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy,
+            zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy)
+    flush_mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    compressed = compressor.compress(data) + compressor.flush(flush_mode)
+    return compressed, zlib.adler32(data), len(data)
+
+
+def write_chunk(output, chunk_type, data):
+    output.write(struct.pack('>I4s', len(data), chunk_type))
+    output.write(data)
+    output.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+class Writer:
+    """Writes paletted PNGs from rows that are already packed, like the
+    write_packed method of png.Writer
+
+    palette is a list of (r, g, b) or (r, g, b, a) tuples. level and strategy
+    are the ones of zlib (see STRATEGIES), and threads is the amount of
+    threads that compress the rows, the number of CPUs by default."""
+
+    def __init__(self, width, height, palette, bitdepth=1, level=DEFAULT_LEVEL,
+        strategy=zlib.Z_DEFAULT_STRATEGY, threads=None, chunk_size=CHUNK_SIZE):
+        assert type(width) == int
+        assert type(height) == int
+        assert bitdepth in [1, 2, 4, 8]
+        assert 1 <= len(palette) <= 2**bitdepth
+        assert -1 <= level <= 9
+        assert strategy in STRATEGIES.values()
+
+        self.width = width
+        self.height = height
+        self.palette = palette
+        self.bitdepth = bitdepth
+        self.level = level
+        self.strategy = strategy
+        self.threads = threads or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def write_packed(self, output, rows):
+        output.write(SIGNATURE)
+        write_chunk(output, b'IHDR', struct.pack('>IIBBBBB', self.width,
+            self.height, self.bitdepth, 3, 0, 0, 0))
+        write_chunk(output, b'PLTE',
+            b''.join(bytes(entry[:3]) for entry in self.palette))
+        if any(len(entry) == 4 for entry in self.palette):
+            write_chunk(output, b'tRNS',
+                bytes(entry[3] if len(entry) == 4 else 255 for entry in self.palette))
+
+        # Every compressed chunk goes to an IDAT of its own, the first one
+        # after the zlib header and the last one before the checksum
+        header = get_zlib_header(self.level, self.strategy)
+        adler = 1
+        for compressed, chunk_adler, length in self.iter_deflated(rows):
+            adler = adler32_combine(adler, chunk_adler, length)
+            write_chunk(output, b'IDAT', header + compressed)
+            header = b''
+        write_chunk(output, b'IDAT', struct.pack('>I', adler))
+        write_chunk(output, b'IEND', b'')
+
+    def iter_chunks(self, rows):
+        """Yield the rows with their filter byte in chunks of about
+        chunk_size bytes, and whether each chunk is the last one"""
+        # Each chunk is held until it's known whether it's the last one
+        chunk = None
+        data = bytearray()
+        for row in rows:
+            data += b'\x00'
+            data += row
+            if len(data) >= self.chunk_size:
+                if chunk is not None:
+                    yield chunk, False
+                chunk, data = bytes(data), bytearray()
+        if data:
+            if chunk is not None:
+                yield chunk, False
+            chunk = bytes(data)
+        yield chunk, True
+
+    def iter_deflated(self, rows):
+        """Yield the result of deflate_chunk for each chunk of rows, in order"""
+        chunks = self.iter_chunks(rows)
+        level, strategy = self.level, self.strategy
+
+        # Small images fit in one chunk and don't need the threads
+        data, last = next(chunks)
+        if last or self.threads == 1:
+            yield deflate_chunk(data, b'', last, level, strategy)
+            dictionary = data[-WINDOW_SIZE:]
+            for data, last in chunks:
+                yield deflate_chunk(data, dictionary, last, level, strategy)
+                dictionary = data[-WINDOW_SIZE:]
+            return
+
+        # Keep a few chunks per thread in flight, so the rows are drawn while
+        # the previous ones are compressed without holding the whole image
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as executor:
+            dictionary = b''
+            while True:
+                pending.append(executor.submit(deflate_chunk, data, dictionary,
+                    last, level, strategy))
+                if last:
+                    break
+                dictionary = data[-WINDOW_SIZE:]
+                if len(pending) >= 2 * self.threads:
+                    yield pending.popleft().result()
+                data, last = next(chunks)
+            while pending:
+                yield pending.popleft().result()
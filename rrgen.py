@@ -1,125 +1,252 @@
 #!/usr/bin/env python3
 
+import contextlib
+import json
+import multiprocessing
 import os
 import sys
-import png
 import random
 
+from cache import Cache
 from cli import parser, query_yes_no
 from colors import Colors
-from core import Grid, Path, Node
-from draw import Drawer
-
-args = parser.parse_args()
-
-# Show available colors
-if args.colors:
-    longest = max(list(Colors), key=lambda c: len(c.name))
-    padding = len(longest.name) + 1
-    print('Available colors:')
-    for color in list(Colors):
-        print(color.name.rjust(padding), color.value)
-    exit(0)
-
-# Configure map color
-if args.color:
-    try:
-        color = Colors[args.color]
-    except KeyError:
-        parser.error(f'Color \'{args.color}\' doesn\'t exist. '
-            'Try --colors to see all the available colors.')
-else:
-    color = random.choice(list(Colors))
-
-# Prevent method 2 with start_at
-if args.method == 2 and args.start_at is not None:
-    parser.error('Method 2 can\'t be used with --start-at')
-
-# Prevents too high of a tolerance (that would result in an empty map)
-if args.method == 1 and (1.0-args.tolerance) * args.width * args.height < 1:
-    parser.error('Tolerance is too high. An empty map would be generated.')
-
-# Configure start position
-if args.start_at is None:
-    start_options = {
-        'bottom_left' : Node(0, 0),
-        'bottom_right' : Node(args.width-1, 0),
-        'top_left' : Node(0, args.height-1),
-        'top_right' : Node(args.width-1, args.height-1),
+from core import Path
+from generator import (check_options, generate_batch, generate_map,
+    generate_variants, get_color)
+from rrp import CUSTOM_METHOD, check_seed, load_path, write_rrp
+
+
+def get_map_options(args):
+    """Return the keyword arguments of generate_map given by args"""
+    return {
+        'width': args.width,
+        'height': args.height,
+        'method': args.method,
+        'tolerance': args.tolerance,
+        'temperature': args.temperature,
+        'backbites': args.backbites,
+        'mixing': args.mixing,
+        'race': args.race,
+        'time_budget': args.time_budget,
+        'start': args.start if args.start_at is None else tuple(args.start_at),
+        'path': args.path,
+        'cell_size': args.cell_size,
+        'wall_thickness': args.wall_thickness,
+        'padding': args.padding,
+        'hide_arrows': args.hide_arrows,
+        'hide_start': args.hide_start,
+        'hide_finish': args.hide_finish,
+        'hide_github': args.hide_github,
+        'preview': args.preview,
+        'compression': args.compression,
+        'strategy': args.strategy,
+        'encode_threads': args.encode_threads,
     }
-    start_position = start_options[args.start]
-else:
-    x, y = args.start_at[0], args.start_at[1]
-    if not 0 <= x < args.width or not 0 <= y < args.height:
-        parser.error('Start position values for X and Y must be within '
-        'boundaries: 0 <= X < WIDTH and 0 <= Y < HEIGHT')
-    start_position = Node(x, y)
-
-# Configure random seed
-if args.seed is None:
-    seed = random.randrange(sys.maxsize)
-    random.seed(seed)
-else:
-    seed = args.seed
-    random.seed(seed)
-
-if args.show_seed:
-    print("Seed:", seed)
-
-# Start of path generation and drawing
-if args.path:
-    path = Path.from_string(args.path)
-    grid = path.grid
-else:
-    grid = Grid(args.width, args.height)
-
-drawer = Drawer(grid, args.cell_size, args.wall_thickness, args.padding,
-    args.hide_arrows, args.hide_start, args.hide_finish, args.hide_github)
-
-# Check image dimensions
-if drawer.img_width > 32512 or drawer.img_height > 32600:
-    parser.error(
-        'The generated map would exceed the maximum dimensions: 32512x32600')
-
-# Warning on big maps
-if not args.path and not args.ignore_warning \
-    and args.width > 40 and args.height > 40:
-    print('WARNING: A huge map is about to be generated! Because of the way '
-        'map generation is implemented, the time to create the path grows '
-        'really fast. Maps bigger than 40x40 can take several minutes to '
-        'generate. Also, take into account that a 50x50 map could take '
-        '30 minutes to finish playing with 1 player. You can suppress this '
-        'warning with --ignore-warning.')
-    answer = query_yes_no('Continue anyway?')
-    if answer == False:
-        exit()
-
-drawer.init_image_array()
-
-if not args.path:
-    path = Path(grid, start=start_position)
-    if args.method == 1:
-        path.build_path_method1(args.tolerance)
-    elif args.method == 2:
-        path.build_path_method2()
-
-if args.show_path:
-    path_str = str(path)
-    print("Path:", path_str)
-
-# Draw image to file
-drawer.draw_path(path, 1)
-img = drawer.img
-img.reverse()
-palette = [ (0, 0, 0, 255), color.value ]
-w = png.Writer(len(img[0]), len(img), palette=palette, bitdepth=8)
-
-filename = os.path.expanduser(args.output)
-if os.path.isdir(filename):
-    filename += 'rrgen.png'
-if not filename.endswith('.png'):
-    filename += '.png'
-
-f = open(filename, 'wb')
-w.write(f, img)
-print(f'Created file {filename}')
+
+
+def get_geometries(args):
+    return args.geometry or [(args.cell_size, args.wall_thickness)]
+
+
+def get_colors(args):
+    return args.color.split(',') if args.color else [None]
+
+
+def has_variants(args):
+    """Return whether args render the map several times"""
+    return args.geometry is not None or len(get_colors(args)) > 1
+
+
+def get_variant_filename(filename, cell_size, wall_thickness, color):
+    return f'{filename[:-len(".png")]}-{cell_size}x{wall_thickness}-{color.name}.png'
+
+
+def read_path(args):
+    """Return the custom path of --path or --path-file as a core.Path (or an
+    rrp.MappedPath), or None"""
+    if args.path is not None:
+        return Path.from_string(args.path)
+    if args.path_file is None:
+        return None
+    if args.path_file == '-':
+        return Path.from_file(sys.stdin)
+    return load_path(os.path.expanduser(args.path_file))
+
+
+def save_rrp(args, result, filename):
+    """Write the path of the map next to its PNG, as an .rrp file"""
+    rrp_filename = filename[:-len('.png')] + '.rrp'
+    custom_path = args.path is not None or args.path_file is not None
+    method = CUSTOM_METHOD if custom_path else args.method
+    # A path cut short by the time budget can't be generated from its seed
+    seed = None if custom_path or result.sacrificed else result.seed
+    with open(rrp_filename, 'wb') as f:
+        write_rrp(f, result.path, seed, method)
+    print(f'Created file {rrp_filename}')
+
+
+def print_map_info(args, result):
+    if args.race > 1:
+        print("Winning seed:", result.seed)
+    if result.sacrificed is not None:
+        if 'coverage' in result.sacrificed:
+            print(f'Time budget ran out: the path covers '
+                f'{result.sacrificed["coverage"]:.1%} of the map')
+        else:
+            print(f'Time budget ran out: '
+                f'{result.sacrificed["skipped_backbites"]} backbites were skipped')
+    if args.show_backbites and args.path is None and args.path_file is None:
+        print("Backbites:", result.backbites)
+    if args.show_path:
+        path_str = str(result.path)
+        print("Path:", path_str)
+    if args.metrics:
+        print(json.dumps(result.metrics, sort_keys=True), file=sys.stderr)
+
+
+def main():
+    # The server has options of its own
+    if sys.argv[1:2] == ['serve']:
+        from server import main as serve
+        serve(sys.argv[2:])
+        return
+
+    args = parser.parse_args()
+
+    if args.output != '-':
+        run(args)
+        return
+
+    if args.count > 1 or args.save_rrp or has_variants(args):
+        parser.error('-o - can\'t be used with --count, --save-rrp, --geometry '
+            'or several colors')
+
+    # The image goes to stdout, so every message goes to stderr
+    stdout = sys.stdout.buffer
+    with contextlib.redirect_stdout(sys.stderr):
+        run(args, stdout)
+
+
+def run(args, stdout=None):
+    """Generate the maps of args, writing the image to stdout if given"""
+    # Show available colors
+    if args.colors:
+        longest = max(list(Colors), key=lambda c: len(c.name))
+        padding = len(longest.name) + 1
+        print('Available colors:')
+        for color in list(Colors):
+            print(color.name.rjust(padding), color.value)
+        exit(0)
+
+    # A batch of custom paths would be the same map over and over
+    custom_path = args.path is not None or args.path_file is not None
+    if args.count > 1 and custom_path:
+        parser.error('--count can\'t be used with --path or --path-file')
+    if args.race > 1 and (args.count > 1 or custom_path):
+        parser.error('--race can\'t be used with --count, --path or --path-file')
+
+    # Variants share one path, and previews have a geometry of their own
+    if has_variants(args) and (args.count > 1 or args.preview is not None):
+        parser.error('--geometry and several colors can\'t be used with --count '
+            'or --preview')
+
+    if args.cache_png and args.cache is None:
+        parser.error('--cache-png can only be used with --cache')
+
+    options = get_map_options(args)
+    try:
+        colors = [get_color(color) for color in get_colors(args)]
+        # Parse the custom path only once, it can be really long
+        options['path'] = read_path(args)
+        if args.save_rrp:
+            check_seed(args.seed)
+        for cell_size, wall_thickness in get_geometries(args):
+            check_options(args.width, args.height, args.method, args.tolerance,
+                options['start'], options['path'], cell_size, wall_thickness,
+                args.padding, args.race, args.preview)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    # Configure random seed
+    if args.seed is None:
+        seed = random.randrange(sys.maxsize)
+    else:
+        seed = args.seed
+
+    # The seed of a race is the one of the winner, shown when it's known
+    if args.show_seed and args.race == 1:
+        print("Seed:", seed)
+
+    # Warning on big maps
+    if not custom_path and not args.ignore_warning and args.method in [1, 2] \
+        and args.width > 40 and args.height > 40:
+        print('WARNING: A huge map is about to be generated! Because of the way '
+            'map generation is implemented, the time to create the path grows '
+            'really fast. Maps bigger than 40x40 can take several minutes to '
+            'generate. Also, take into account that a 50x50 map could take '
+            '30 minutes to finish playing with 1 player. You can suppress this '
+            'warning with --ignore-warning.')
+        answer = query_yes_no('Continue anyway?')
+        if answer == False:
+            exit()
+
+    if args.cache is not None:
+        options['cache'] = Cache(os.path.expanduser(args.cache),
+            args.cache_size * 2**20, store_png=args.cache_png)
+
+    filename = os.path.expanduser(args.output)
+
+    # Batch mode: each map gets a seed derived from the master seed
+    if args.count > 1:
+        results = generate_batch(args.count, filename, seed=seed, jobs=args.jobs,
+            color=args.color, **options)
+        for map_filename, result in results:
+            print_map_info(args, result)
+            print(f'Created file {map_filename}')
+            if args.save_rrp:
+                save_rrp(args, result, map_filename)
+        return
+
+    if stdout is not None:
+        result = generate_map(seed=seed, color=colors[0], output=stdout,
+            jobs=args.jobs, **options)
+        stdout.flush()
+        print_map_info(args, result)
+        return
+
+    if os.path.isdir(filename):
+        filename += 'rrgen.png'
+    if not filename.endswith('.png'):
+        filename += '.png'
+
+    # Variants: the same path at several geometries and colors
+    if has_variants(args):
+        for name in ['cell_size', 'wall_thickness', 'preview']:
+            del options[name]
+        result = generate_variants(get_geometries(args), colors, seed=seed,
+            jobs=args.jobs, **options)
+        print_map_info(args, result)
+        for cell_size, wall_thickness, color, png_data in result.variants:
+            variant_filename = get_variant_filename(filename, cell_size,
+                wall_thickness, color)
+            with open(variant_filename, 'wb') as f:
+                f.write(png_data)
+            print(f'Created file {variant_filename}')
+        if args.save_rrp:
+            save_rrp(args, result, filename)
+        return
+
+    with open(filename, 'wb') as f:
+        result = generate_map(seed=seed, color=colors[0], output=f, jobs=args.jobs,
+            **options)
+
+    print_map_info(args, result)
+    print(f'Created file {filename}')
+    if args.save_rrp:
+        save_rrp(args, result, filename)
+
+
+if __name__ == '__main__':
+    # Needed by the worker processes of the Windows binary
+    multiprocessing.freeze_support()
+    main()
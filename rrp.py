@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Compact binary format for paths (.rrp).
+
+An .rrp file is a header followed by the moves of the path, 2 bits each and 4
+per byte, with the first move in the highest bits. The header holds:
+
+    magic       4 bytes, b'RRP1'
+    method      1 byte, 0 for custom paths
+    flags       1 byte, bit 0 is set if the seed is known
+    (padding)   2 bytes
+    width       uint32
+    height      uint32
+    start x     uint32
+    start y     uint32
+    seed        int64
+    moves       uint64, the amount of moves
+
+All the numbers are little-endian. MappedPath maps a file in memory and only
+decodes the moves when they are needed, so huge paths can be inspected,
+rendered and converted without building a core.Path."""
+
+import argparse
+import collections
+import mmap
+import os
+import struct
+import sys
+
+from core import Grid, Node, Path
+
+
+MAGIC = b'RRP1'
+HEADER = struct.Struct('<4sBBxxIIIIqQ')
+CUSTOM_METHOD = 0
+SEED_FLAG = 1
+
+# Each move is a base 4 digit, and each hex digit holds two of them
+_MOVES_TO_DIGITS = str.maketrans('ruld', '0123')
+_HEX_TO_MOVES = {ord(f'{i:x}'): 'ruld'[i // 4] + 'ruld'[i % 4] for i in range(16)}
+
+
+def encode_moves(moves):
+    """Return the moves string packed at 2 bits per move"""
+    digits = moves.translate(_MOVES_TO_DIGITS)
+    digits += '0' * (-len(digits) % 4)
+    if not digits:
+        return b''
+    # Conversions from bases that are powers of 2 take linear time
+    return int(digits, 4).to_bytes(len(digits) // 4, 'big')
+
+
+def decode_moves(data, count):
+    """Return the first count moves packed in data"""
+    return data.hex().translate(_HEX_TO_MOVES)[:count]
+
+
+def check_seed(seed):
+    """Raise ValueError if seed doesn't fit in the header"""
+    if seed is not None and not -2**63 <= seed < 2**63:
+        raise ValueError('The seed of an .rrp file must fit in 64 bits (signed)')
+
+
+def write_rrp(f, path, seed=None, method=CUSTOM_METHOD):
+    """Write path to the binary file f. path is a core.Path, or anything with
+    a grid, a start and get_moves(), like MappedPath."""
+    check_seed(seed)
+    moves = path.get_moves()
+    if moves.strip('ruld'):
+        raise ValueError('The path has invalid moves')
+
+    flags = 0 if seed is None else SEED_FLAG
+    f.write(HEADER.pack(MAGIC, method, flags, path.grid.width, path.grid.height,
+        path.start.x, path.start.y, seed or 0, len(moves)))
+    f.write(encode_moves(moves))
+
+
+def is_rrp(filename):
+    """Return whether filename starts like an .rrp file"""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class MappedPath:
+    """A path in an .rrp file, mapped in memory.
+
+    It has the grid, start, get_moves(), get_occupancy() and __str__ of a
+    core.Path, so it can be rendered as it is. seed is None if it isn't known."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f'{filename} is not an .rrp file')
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self.method, flags, width, height, start_x, start_y, seed,
+            self.move_count) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not an .rrp file')
+        if size < HEADER.size + (self.move_count + 3) // 4:
+            raise ValueError(f'{filename} is truncated')
+        if self.move_count == 0:
+            raise ValueError(f'{filename} has an empty path')
+        if not (0 <= start_x < width and 0 <= start_y < height):
+            raise ValueError(f'{filename} starts outside of its grid')
+        if self.move_count + 1 > width * height:
+            raise ValueError(f'{filename} has more moves than its grid has cells')
+
+        self.grid = Grid(width, height)
+        self.start = Node(start_x, start_y)
+        self.seed = seed if flags & SEED_FLAG else None
+
+    def __str__(self):
+        return self.get_moves()
+
+    def __len__(self):
+        return self.move_count
+
+    def close(self):
+        self.data.close()
+
+    def iter_moves(self, chunk_size=65536):
+        """Yield the moves in strings of up to 4 * chunk_size moves"""
+        end = HEADER.size + (self.move_count + 3) // 4
+        left = self.move_count
+        for offset in range(HEADER.size, end, chunk_size):
+            moves = decode_moves(self.data[offset:min(offset + chunk_size, end)], left)
+            left -= len(moves)
+            yield moves
+
+    def get_moves(self):
+        return ''.join(self.iter_moves())
+
+    def iter_cells(self):
+        """Yield the (x, y) of each cell of the path, from the start"""
+        steps = {'r': (1, 0), 'u': (0, 1), 'l': (-1, 0), 'd': (0, -1)}
+        x, y = self.start.x, self.start.y
+        yield x, y
+        for moves in self.iter_moves():
+            for move in moves:
+                dx, dy = steps[move]
+                x, y = x + dx, y + dy
+                yield x, y
+
+    def get_occupancy(self):
+        """Return the bitmap of visited cells, as core.Path.get_occupancy
+
+        The path must have passed check()."""
+        width = self.grid.width
+        occupancy = bytearray(self.grid.get_size())
+        for x, y in self.iter_cells():
+            occupancy[y * width + x] = 1
+        return occupancy
+
+    def check(self):
+        """Raise ValueError if the path leaves its grid or overlaps itself"""
+        width, height = self.grid.width, self.grid.height
+        # The header can claim a huge grid, so only keep a byte per cell when
+        # the path covers a good part of it
+        if width * height <= 64 * (self.move_count + 1):
+            visited = bytearray(width * height)
+        else:
+            visited = collections.defaultdict(int)
+        for x, y in self.iter_cells():
+            if not (0 <= x < width and 0 <= y < height):
+                raise ValueError('The path leaves the grid')
+            if visited[y * width + x]:
+                raise ValueError('The path overlaps itself')
+            visited[y * width + x] = 1
+
+    def to_path(self):
+        """Return the equivalent core.Path, checking that it's valid"""
+        return Path.from_moves(self.grid, self.start, self.get_moves())
+
+
+def load_path(filename):
+    """Return the path in filename, which is an .rrp file or a text file with
+    a path string, raising ValueError if it's invalid"""
+    if is_rrp(filename):
+        path = MappedPath(filename)
+        path.check()
+        return path
+    with open(filename) as f:
+        return Path.from_file(f)
+
+
+def write_moves(path, f):
+    for moves in path.iter_moves():
+        f.write(moves)
+    f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts paths between the text and the .rrp formats')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    info = commands.add_parser('info',
+        help='Show the header of an .rrp file')
+    info.add_argument('input')
+
+    encode = commands.add_parser('encode',
+        help='Convert a text path (or - for the standard input) to .rrp')
+    encode.add_argument('input')
+    encode.add_argument('output')
+    encode.add_argument('--seed',
+        help='The seed that generated the path, if it is known',
+        type=int)
+    encode.add_argument('--method',
+        help='The method that generated the path (default: 0, a custom path)',
+        type=int, choices=[CUSTOM_METHOD, 1, 2, 3, 4], default=CUSTOM_METHOD)
+
+    decode = commands.add_parser('decode',
+        help='Convert an .rrp file to a text path (written to the standard '
+            'output if there is no output file)')
+    decode.add_argument('input')
+    decode.add_argument('output', nargs='?')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'info':
+            path = MappedPath(args.input)
+            seed = 'unknown' if path.seed is None else path.seed
+            method = 'custom' if path.method == CUSTOM_METHOD else path.method
+            print(f'Grid: {path.grid.width}x{path.grid.height}')
+            print(f'Start: {path.start}')
+            print(f'Moves: {len(path)}')
+            print(f'Method: {method}')
+            print(f'Seed: {seed}')
+
+        elif args.command == 'encode':
+            check_seed(args.seed)
+            if args.input == '-':
+                path = Path.from_file(sys.stdin)
+            else:
+                with open(args.input) as f:
+                    path = Path.from_file(f)
+            with open(args.output, 'wb') as f:
+                write_rrp(f, path, args.seed, args.method)
+
+        elif args.command == 'decode':
+            path = MappedPath(args.input)
+            if args.output is None:
+                write_moves(path, sys.stdout)
+            else:
+                with open(args.output, 'w') as f:
+                    write_moves(path, f)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
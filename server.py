@@ -0,0 +1,269 @@
+"""Local HTTP server that generates maps, started with `rrgen.py serve`.
+
+GET /map takes the options of the command line as query arguments (for
+example /map?width=10&height=10&color=red&hide-arrows) and returns the PNG.
+GET /stats returns the queue depth, the count of responses by status and the
+latency of the last maps as JSON. Maps are generated in a pool of worker
+processes, so the event loop only parses requests and sends responses."""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import statistics
+import time
+import urllib.parse
+
+from cli import assert_is_positive, check_time_budget, parser as map_parser
+from generator import check_encoding, check_options, generate_map, get_color
+from rrgen import get_map_options
+
+
+# The options of the command line that can be passed as query arguments
+QUERY_OPTIONS = [
+    'width', 'height', 'seed', 'color', 'method', 'tolerance', 'temperature',
+    'backbites', 'mixing', 'time_budget', 'start', 'start_at', 'path',
+    'cell_size', 'wall_thickness', 'padding', 'hide_arrows', 'hide_start',
+    'hide_finish', 'hide_github', 'preview', 'compression', 'strategy',
+]
+
+MAX_REQUEST_SIZE = 65536
+DEFAULT_TIME_BUDGET = 30.0
+LATENCY_WINDOW = 1000
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+def parse_query(query):
+    """Return the arguments of the command line given by a query string,
+    raising ValueError if any of them is invalid"""
+    args = map_parser.parse_args([])
+    actions = {action.dest: action for action in map_parser._actions}
+
+    for key, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        dest = key.replace('-', '_')
+        if dest not in QUERY_OPTIONS:
+            raise ValueError(f'Unknown option: {key}')
+        action = actions[dest]
+
+        # Flags are set by their name alone or by a true value
+        if action.nargs == 0:
+            setattr(args, dest, value.lower() not in ['0', 'false', 'no'])
+            continue
+
+        # Options with an optional value, like preview, take the default one
+        # when they are given alone
+        if action.nargs == '?' and value == '':
+            setattr(args, dest, action.const)
+            continue
+
+        # Options with several values, like start-at, separate them with commas
+        several = type(action.nargs) == int
+        values = value.split(',') if several else [value]
+        if several and len(values) != action.nargs:
+            raise ValueError(f'{key} takes {action.nargs} values separated by commas')
+        try:
+            values = [action.type(v) if action.type else v for v in values]
+        except (argparse.ArgumentTypeError, ValueError) as e:
+            raise ValueError(f'{key}: {e}')
+        if action.choices is not None and any(v not in action.choices for v in values):
+            raise ValueError(f'{key} must be one of: '
+                + ', '.join(str(choice) for choice in action.choices))
+
+        setattr(args, dest, values if several else values[0])
+    return args
+
+
+def check_query_options(options):
+    """Raise ValueError if the options of generate_map given by a query are
+    invalid, so workers only fail on unexpected errors"""
+    check_options(options['width'], options['height'], options['method'],
+        options['tolerance'], options['start'], options['path'],
+        options['cell_size'], options['wall_thickness'], options['padding'],
+        options['race'], options['preview'])
+    check_encoding(options['compression'], options['strategy'])
+    if options['color'] is not None:
+        get_color(options['color'])
+
+
+def _warm_worker():
+    # Import everything and fill the caches of the default cell geometry
+    generate_map(width=2, height=2, seed=0, method=3, color='white')
+
+
+def _generate(options):
+    result = generate_map(**options)
+    return result.png, result.seed, result.color.name, result.backbites
+
+
+class Server:
+    """The state shared by the requests: the worker pool and the stats"""
+
+    def __init__(self, workers=None, max_queue=64, time_budget=DEFAULT_TIME_BUDGET):
+        self.workers = workers or os.cpu_count()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers,
+            initializer=_warm_worker)
+        self.max_queue = max_queue
+        self.time_budget = time_budget
+
+        self.started = time.monotonic()
+        self.queue_depth = 0
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def get_stats(self):
+        latencies = sorted(self.latencies)
+        stats = {
+            'uptime': round(time.monotonic() - self.started, 3),
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'max_queue': self.max_queue,
+            'requests': dict(self.counts),
+            'latency': None,
+        }
+        if latencies:
+            stats['latency'] = {
+                'count': len(latencies),
+                'mean': round(statistics.mean(latencies), 6),
+                'p50': round(statistics.median(latencies), 6),
+                'p95': round(latencies[math.ceil(0.95 * len(latencies)) - 1], 6),
+                'max': round(latencies[-1], 6),
+            }
+        return stats
+
+    async def generate(self, query):
+        """Return the status, the headers and the body of a map request"""
+        start = time.monotonic()
+        try:
+            args = parse_query(query)
+            options = get_map_options(args)
+            options['seed'] = args.seed
+            options['color'] = args.color
+            check_query_options(options)
+        except ValueError as e:
+            return 400, {}, str(e).encode()
+        # The workers already compress several maps at once
+        options['encode_threads'] = 1
+
+        if self.time_budget is not None:
+            budget = options['time_budget']
+            options['time_budget'] = self.time_budget if budget is None \
+                else min(budget, self.time_budget)
+
+        if self.queue_depth >= self.max_queue:
+            return 503, {'Retry-After': '1'}, b'Too many maps in the queue'
+
+        loop = asyncio.get_running_loop()
+        self.queue_depth += 1
+        try:
+            png, seed, color, backbites = await loop.run_in_executor(
+                self.executor, _generate, options)
+        finally:
+            self.queue_depth -= 1
+        self.latencies.append(time.monotonic() - start)
+
+        headers = {
+            'Content-Type': 'image/png',
+            'X-Seed': str(seed),
+            'X-Color': color,
+            'X-Backbites': str(backbites),
+        }
+        return 200, headers, png
+
+    async def handle(self, reader, writer):
+        try:
+            status, headers, body = await self.respond(reader)
+        except Exception as e:
+            status, headers, body = 500, {}, f'{type(e).__name__}: {e}'.encode()
+        self.counts[str(status)] += 1
+
+        headers.setdefault('Content-Type', 'text/plain; charset=utf-8')
+        headers['Content-Length'] = str(len(body))
+        headers['Connection'] = 'close'
+        head = f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n' \
+            + ''.join(f'{name}: {value}\r\n' for name, value in headers.items()) \
+            + '\r\n'
+        try:
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return 400, {}, b'Invalid request'
+
+        try:
+            method, target, _ = request.split(b'\r\n', 1)[0].decode().split(' ')
+        except (UnicodeDecodeError, ValueError):
+            return 400, {}, b'Invalid request'
+        if method != 'GET':
+            return 405, {'Allow': 'GET'}, b'Only GET is supported'
+
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/stats':
+            body = json.dumps(self.get_stats(), sort_keys=True).encode()
+            return 200, {'Content-Type': 'application/json'}, body
+        if url.path in ['/', '/map']:
+            return await self.generate(url.query)
+        return 404, {}, b'Not found'
+
+    def start_workers(self):
+        """Start and warm up all the workers before the first request"""
+        for future in [self.executor.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port,
+            limit=MAX_REQUEST_SIZE)
+        print(f'Serving maps on http://{host}:{port}/map with {self.workers} workers')
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='rrgen.py serve',
+        description='Serves rope race maps over HTTP. GET /map takes the '
+            'options of rrgen.py as query arguments and returns the PNG, and '
+            'GET /stats returns the queue depth and latency stats as JSON.')
+    parser.add_argument('--host',
+        help='The address to listen on (default: 127.0.0.1)',
+        default='127.0.0.1')
+    parser.add_argument('--port',
+        help='The port to listen on (default: 8000)',
+        type=int, default=8000)
+    parser.add_argument('--workers',
+        help='The amount of worker processes (default: the number of CPUs)',
+        type=assert_is_positive)
+    parser.add_argument('--max-queue',
+        help='The amount of maps that can be waiting or being generated at '
+            'once. Requests beyond it get a 503 (default: 64)',
+        type=assert_is_positive, default=64)
+    parser.add_argument('--time-budget',
+        help='The maximum --time-budget of every map, in seconds, so no map can '
+            f'keep a worker busy for long (default: {DEFAULT_TIME_BUDGET:g})',
+        type=check_time_budget, default=DEFAULT_TIME_BUDGET, metavar='SECONDS')
+    args = parser.parse_args(argv)
+
+    server = Server(args.workers, args.max_queue, args.time_budget)
+    server.start_workers()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(cancel_futures=True)